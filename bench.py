@@ -0,0 +1,64 @@
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+# Add current directory to path so we can import trader
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import trader
+
+def _timed(fn, *args, **kwargs):
+    start = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+def run_bench(size, universe, workdir, batch_size):
+    tickers = universe[:size]
+    trader.METRICS.reset()
+    db = trader.StockDatabase(os.path.join(workdir, f"bench_{size}.db"))
+    stages = {}
+
+    raws, stages["collect"] = _timed(trader.collect_universe, tickers)
+    _, stages["analyze"] = _timed(trader.score_universe, raws, batch_size=batch_size)
+    (_, scores, _), stages["pipeline"] = _timed(trader.run_pipeline, tickers, db, batch_size=batch_size)
+    cand = sorted(({"ticker": t, "name": t, "scores": sc} for t, sc in scores.items()), key=lambda x: sum(x['scores'].values()), reverse=True)
+    strategy = trader.strategy_agent("No history.", trader.get_market_overview())
+    llm_pick, stages["select"] = _timed(trader.selection_agent, strategy, cand[:30])
+    numeric_pick, stages["select_numeric"] = _timed(trader.numeric_selection, strategy, cand[:30])
+    db.close()
+
+    overlap = {s.get("stock_code") for s in llm_pick.get("selected_stocks", [])} & {s["stock_code"] for s in numeric_pick["selected_stocks"]}
+    return {"size": len(tickers), "collected": len(raws), "metrics": trader.METRICS.manifest(), "selection_overlap": len(overlap),
+            "stages": {k: {"wall_s": round(v, 3), "tickers_per_s": round(len(tickers) / v, 1) if v > 0 else None} for k, v in stages.items()}}
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline end-to-end benchmark (record/replay fixtures)")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[30, 300, 1700])
+    parser.add_argument("--fixtures", default=trader.FIXTURE_DIR)
+    parser.add_argument("--latency", default=None, help='JSON, e.g. {"default": 0.05, "llm": 0.8}')
+    parser.add_argument("--batch-size", type=int, default=trader.SCORE_BATCH_SIZE)
+    parser.add_argument("--json", dest="json_out", default=None, help="write results to this file")
+    args = parser.parse_args()
+
+    trader.TAPE = trader.Tape("replay", args.fixtures, json.loads(args.latency) if args.latency else None)
+    trader.LLM_CACHE_ENABLED = False
+    universe = json.load(open(trader.UNIVERSE_PATH))["tickers"]
+
+    results = []
+    with tempfile.TemporaryDirectory() as workdir:
+        trader.NEWS_DB_PATH = os.path.join(workdir, "news.db")
+        for size in args.sizes:
+            res = run_bench(size, universe, workdir, args.batch_size)
+            results.append(res)
+            print(f"\n=== universe {res['size']} (collected {res['collected']}) ===")
+            for stage, m in res["stages"].items():
+                print(f" {stage:<9} {m['wall_s']:>8.3f}s  {m['tickers_per_s']} tickers/s")
+
+    if args.json_out:
+        json.dump(results, open(args.json_out, "w"), indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -1,20 +1,58 @@
-import yfinance as yf
-import pandas as pd
-import numpy as np
-from datetime import datetime, timedelta
+from __future__ import annotations
+
+from datetime import datetime, timedelta, timezone
+from email.utils import parsedate_to_datetime
 import os
-import requests
-from bs4 import BeautifulSoup
+import sys
 import time
 import json
+import hashlib
+import functools
+import importlib
+import random
 import re
 import sqlite3
+import asyncio
+import threading
+import queue
+import argparse
+import subprocess
+import multiprocessing
+from urllib.parse import urlparse
 from typing import Any, Dict, List, Optional, Tuple
-import FinanceDataReader as fdr
-from pykrx import stock
-from concurrent.futures import ThreadPoolExecutor, as_completed
-import OpenDartReader
-import psycopg2
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait, FIRST_COMPLETED
+
+class _LazyModule:
+    """첫 속성 접근(또는 호출) 시점에 import. 서브커맨드가 쓰지 않는 무거운 의존성의 로딩을 피한다"""
+    def __init__(self, name: str):
+        self.__dict__["_name"], self.__dict__["_module"] = name, None
+
+    def _load(self):
+        if self.__dict__["_module"] is None:
+            self.__dict__["_module"] = importlib.import_module(self.__dict__["_name"])
+        return self.__dict__["_module"]
+
+    def __getattr__(self, attr):
+        return getattr(self._load(), attr)
+
+    def __call__(self, *args, **kwargs):
+        return self._load()(*args, **kwargs)
+
+yf = _LazyModule("yfinance")
+pd = _LazyModule("pandas")
+np = _LazyModule("numpy")
+requests = _LazyModule("requests")
+fdr = _LazyModule("FinanceDataReader")
+stock = _LazyModule("pykrx.stock")
+OpenDartReader = _LazyModule("OpenDartReader")
+psycopg2 = _LazyModule("psycopg2")
+pa = _LazyModule("pyarrow")
+pq = _LazyModule("pyarrow.parquet")
+
+def BeautifulSoup(*args, **kwargs):
+    from bs4 import BeautifulSoup as _BeautifulSoup
+    return _BeautifulSoup(*args, **kwargs)
 
 # --- Configuration ---
 STATE_DIR = "state"
@@ -39,6 +77,180 @@ POSTGRES_DB = os.getenv("DB_NAME", "marketsense")
 POSTGRES_USER = os.getenv("DB_USER", "yrbahn")
 POSTGRES_PASSWORD = os.getenv("DB_PASSWORD", "1234")
 
+# --- Metrics (실행 매니페스트 / Prometheus textfile) ---
+
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+class Metrics:
+    """단계별 소요시간, 호스트별 지연 히스토그램, 재시도/실패 카운터, 모델별 LLM 사용량 수집"""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.started_at = datetime.now().isoformat()
+            self.stages: Dict[str, float] = {}
+            self.hosts: Dict[str, Dict[str, Any]] = {}
+            self.counters: Dict[Tuple[str, str], int] = {}
+            self.llm: Dict[str, Dict[str, float]] = {}
+
+    @contextmanager
+    def stage(self, name: str):
+        t0 = time.perf_counter()
+        try: yield
+        finally:
+            with self._lock: self.stages[name] = self.stages.get(name, 0.0) + time.perf_counter() - t0
+
+    def observe_host(self, host: str, seconds: float):
+        with self._lock:
+            h = self.hosts.setdefault(host, {"count": 0, "sum": 0.0, "buckets": [0] * len(LATENCY_BUCKETS)})
+            h["count"] += 1; h["sum"] += seconds
+            for i, le in enumerate(LATENCY_BUCKETS):
+                if seconds <= le: h["buckets"][i] += 1
+
+    @contextmanager
+    def timed(self, host: str):
+        """HostLimiter를 거치지 않는 외부 호출(벌크 다운로드, pykrx, DB, LLM)의 지연을 호스트별 히스토그램에 기록"""
+        t0 = time.perf_counter()
+        try: yield
+        finally: self.observe_host(host, time.perf_counter() - t0)
+
+    def incr(self, event: str, source: str = "", n: int = 1):
+        """event: retries | failures | json_parse_failures ..."""
+        with self._lock: self.counters[(event, source)] = self.counters.get((event, source), 0) + n
+
+    def observe_llm(self, model: str, seconds: float = 0.0, prompt_tokens: int = 0, completion_tokens: int = 0, calls: int = 0):
+        with self._lock:
+            m = self.llm.setdefault(model, {"calls": 0, "latency_sum": 0.0, "prompt_tokens": 0, "completion_tokens": 0})
+            m["calls"] += calls; m["latency_sum"] += seconds
+            m["prompt_tokens"] += prompt_tokens; m["completion_tokens"] += completion_tokens
+
+    def manifest(self, **extra) -> Dict[str, Any]:
+        with self._lock:
+            hosts = {h: {"count": v["count"], "avg_s": round(v["sum"] / v["count"], 4) if v["count"] else None,
+                         "buckets": dict(zip([str(b) for b in LATENCY_BUCKETS], v["buckets"]))} for h, v in self.hosts.items()}
+            return {"started_at": self.started_at, "finished_at": datetime.now().isoformat(),
+                    "stages_s": {k: round(v, 3) for k, v in self.stages.items()}, "hosts": hosts,
+                    "counters": [{"event": e, "source": src, "count": n} for (e, src), n in sorted(self.counters.items())],
+                    "llm": {k: dict(v) for k, v in self.llm.items()}, **extra}
+
+    def to_prometheus(self) -> str:
+        def _lbl(**kv): return "{" + ",".join(f'{k}="{v}"' for k, v in kv.items()) + "}"
+        out = ["# HELP trader_stage_seconds Wall time per pipeline stage", "# TYPE trader_stage_seconds gauge"]
+        with self._lock:
+            out += [f"trader_stage_seconds{_lbl(stage=k)} {v:.6f}" for k, v in self.stages.items()]
+            out += ["# HELP trader_host_latency_seconds External call latency per host", "# TYPE trader_host_latency_seconds histogram"]
+            for h, v in self.hosts.items():
+                out += [f"trader_host_latency_seconds_bucket{_lbl(host=h, le=le)} {n}" for le, n in zip(LATENCY_BUCKETS, v["buckets"])]
+                out += [f"trader_host_latency_seconds_bucket{_lbl(host=h, le='+Inf')} {v['count']}",
+                        f"trader_host_latency_seconds_sum{_lbl(host=h)} {v['sum']:.6f}", f"trader_host_latency_seconds_count{_lbl(host=h)} {v['count']}"]
+            out += ["# HELP trader_events_total Retries, failures and JSON parse failures", "# TYPE trader_events_total counter"]
+            out += [f"trader_events_total{_lbl(event=e, source=src)} {n}" for (e, src), n in sorted(self.counters.items())]
+            out += ["# HELP trader_llm_calls_total LLM calls per model", "# TYPE trader_llm_calls_total counter"]
+            out += [f"trader_llm_calls_total{_lbl(model=m)} {int(v['calls'])}" for m, v in self.llm.items()]
+            out += ["# HELP trader_llm_tokens_total LLM tokens per model", "# TYPE trader_llm_tokens_total counter"]
+            for m, v in self.llm.items():
+                out += [f"trader_llm_tokens_total{_lbl(model=m, type='prompt')} {int(v['prompt_tokens'])}",
+                        f"trader_llm_tokens_total{_lbl(model=m, type='completion')} {int(v['completion_tokens'])}"]
+            out += ["# HELP trader_llm_latency_seconds_sum Total LLM latency per model", "# TYPE trader_llm_latency_seconds_sum counter"]
+            out += [f"trader_llm_latency_seconds_sum{_lbl(model=m)} {v['latency_sum']:.6f}" for m, v in self.llm.items()]
+        return "\n".join(out) + "\n"
+
+    def write(self, out_dir: str, date_str: str, **extra) -> Tuple[str, str]:
+        os.makedirs(out_dir, exist_ok=True)
+        manifest_path = os.path.join(out_dir, f"3S_Run_Manifest_{date_str}.json")
+        prom_path = os.path.join(out_dir, f"3S_Trader_Metrics_{date_str}.prom")
+        json.dump(self.manifest(**extra), open(manifest_path, "w", encoding="utf-8"), ensure_ascii=False, indent=2)
+        with open(prom_path, "w", encoding="utf-8") as f: f.write(self.to_prometheus())
+        return manifest_path, prom_path
+
+METRICS = Metrics()
+
+# --- Record / Replay (오프라인 벤치마크용) ---
+
+REPLAY_MODE = os.getenv("TRADER_REPLAY", "").strip().lower()  # "" | "record" | "replay"
+FIXTURE_DIR = os.getenv("TRADER_FIXTURE_DIR", os.path.join(STATE_DIR, "fixtures"))
+# 재생 시 주입할 종류별 지연(초). 예: '{"default": 0.05, "llm": 0.8}'
+REPLAY_LATENCY = json.loads(os.getenv("TRADER_REPLAY_LATENCY", "{}"))
+
+class Tape:
+    """외부 호출 결과를 종류(kind)별 JSON 픽스처로 기록하고 재생
+
+    replay 모드에서 정확히 일치하는 픽스처가 없으면 같은 종류의 다른 픽스처를 키 해시로 골라
+    대신 쓰므로, 30종목만 기록해도 1,700종목 규모를 재생할 수 있다. LLM은 결정적 스텁으로 응답.
+    """
+    def __init__(self, mode: str, root: str = FIXTURE_DIR, latency: Optional[Dict[str, float]] = None):
+        self.mode, self.root = mode, root
+        self.latency = latency if latency is not None else REPLAY_LATENCY
+        self._pools: Dict[str, List[Any]] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(args, kwargs) -> str:
+        return json.dumps([args, kwargs], ensure_ascii=False, sort_keys=True, default=str)
+
+    def _path(self, kind: str, key: str) -> str:
+        return os.path.join(self.root, kind, hashlib.sha1(key.encode("utf-8")).hexdigest()[:20] + ".json")
+
+    def _pool(self, kind: str) -> List[Any]:
+        with self._lock:
+            if kind not in self._pools:
+                d = os.path.join(self.root, kind)
+                files = sorted(os.listdir(d)) if os.path.isdir(d) else []
+                self._pools[kind] = [json.load(open(os.path.join(d, f), encoding="utf-8"))["result"] for f in files]
+            return self._pools[kind]
+
+    def call(self, kind: str, fn, args: Tuple, kwargs: Dict, by_ticker: bool = False, stub=None):
+        key = self._key(args, kwargs)
+        if self.mode == "record":
+            result = fn(*args, **kwargs)
+            path = self._path(kind, key); os.makedirs(os.path.dirname(path), exist_ok=True)
+            json.dump({"key": key, "result": result}, open(path, "w", encoding="utf-8"), ensure_ascii=False, default=str)
+            return result
+        time.sleep(self.latency.get(kind, self.latency.get("default", 0.0)))
+        path = self._path(kind, key)
+        if os.path.exists(path): return json.load(open(path, encoding="utf-8"))["result"]
+        if stub: return stub(*args, **kwargs)
+        pool = [p for p in self._pool(kind) if p] or self._pool(kind)
+        if not pool: raise KeyError(f"no fixture recorded for '{kind}'")
+        if by_ticker:
+            # {ticker: value} 결과는 요청 종목에 기록된 값들을 순환 배정
+            values = [v for p in pool for v in p.values()]
+            return {t: values[int(hashlib.sha1(t.encode()).hexdigest(), 16) % len(values)] for t in args[0]} if values else {}
+        return pool[int(hashlib.sha1(key.encode("utf-8")).hexdigest(), 16) % len(pool)]
+
+TAPE: Optional[Tape] = Tape(REPLAY_MODE) if REPLAY_MODE in ("record", "replay") else None
+
+def taped(kind: str, by_ticker: bool = False, stub=None):
+    """TAPE가 설정되어 있으면 호출을 기록/재생하는 데코레이터. by_ticker: 첫 인자가 종목 리스트이고 결과가 {ticker: ...}"""
+    def deco(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if TAPE is None: return fn(*args, **kwargs)
+            return TAPE.call(kind, fn, args, kwargs, by_ticker=by_ticker, stub=stub)
+        return wrapper
+    return deco
+
+def _stub_llm(messages: List[Dict[str, str]], model: str, temperature: float) -> str:
+    """재생 모드용 결정적 LLM 대역. 프롬프트 해시로 점수/선택을 만든다"""
+    prompt = "\n".join(m['content'] for m in messages)
+    seed = int(hashlib.sha1(prompt.encode("utf-8")).hexdigest(), 16)
+    def _scores(salt: str):
+        h = hashlib.sha1((salt + prompt[:64]).encode("utf-8")).digest()
+        return {d: 1 + h[i] % 10 for i, d in enumerate(SCORING_DIMENSIONS)}
+    tickers = list(dict.fromkeys(re.findall(r"\d{6}\.K[SQ]", prompt)))
+    if "Summarize each news article" in prompt:
+        return json.dumps({i: f"replay summary {i}" for i in dict.fromkeys(re.findall(r"\[([0-9a-f]{16})\]", prompt))})
+    if "Score each stock" in prompt: return json.dumps({t: _scores(t) for t in tickers})
+    if "Score 6 dimensions" in prompt: return json.dumps({"scores": _scores(str(seed))})
+    if "stock-picker" in prompt:
+        picks = tickers[:5]
+        return json.dumps({"selected_stocks": [{"stock_code": t, "weight": 100 // max(len(picks), 1)} for t in picks], "reasoning": "replay stub"})
+    return f"Deterministic replay summary #{seed % 10000}."
+
+POSTGRES_POOL_MAX = int(os.getenv("DB_POOL_MAX", 4))
+
 def get_postgres_connection():
     """PostgreSQL 연결"""
     return psycopg2.connect(
@@ -49,61 +261,140 @@ def get_postgres_connection():
         password=POSTGRES_PASSWORD
     )
 
+class PostgresPool:
+    """크기가 제한된 PostgreSQL 커넥션 풀 (풀이 비면 반납될 때까지 대기)"""
+    def __init__(self, maxconn: int = POSTGRES_POOL_MAX, connect=get_postgres_connection):
+        self._connect = connect
+        self._idle: List[Any] = []
+        self._slots = threading.BoundedSemaphore(maxconn)
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def connection(self):
+        self._slots.acquire()
+        try:
+            with self._lock:
+                conn = self._idle.pop() if self._idle else None
+            conn = conn or self._connect()
+            try:
+                yield conn
+                conn.rollback()
+            except Exception:
+                conn.close(); raise
+            with self._lock:
+                self._idle.append(conn)
+        finally:
+            self._slots.release()
+
+    def close(self):
+        with self._lock:
+            for conn in self._idle: conn.close()
+            self._idle.clear()
+
+_pg_pool: Optional[PostgresPool] = None
+_pg_pool_lock = threading.Lock()
+
+def get_postgres_pool() -> PostgresPool:
+    global _pg_pool
+    with _pg_pool_lock:
+        if _pg_pool is None: _pg_pool = PostgresPool()
+        return _pg_pool
+
+def _aggregate_fundamentals(rows: List[Tuple]) -> Dict:
+    """최근 분기 행(period_end 내림차순)에서 4분기 합산/평균, ROE/ROA 계산 (억원 단위)"""
+    if not rows:
+        return {}
+    
+    # 최근 4분기 합산 및 평균
+    total_revenue = sum(r[0] or 0 for r in rows)
+    total_net_income = sum(r[1] or 0 for r in rows)
+    total_op_income = sum(r[2] or 0 for r in rows)
+    avg_assets = sum(r[3] or 0 for r in rows) / len(rows) if rows else 0
+    avg_equity = sum(r[4] or 0 for r in rows) / len(rows) if rows else 0
+    latest_eps = rows[0][5] if rows[0][5] else None
+    
+    # ROE, ROA 계산
+    roe = (total_net_income / avg_equity * 100) if avg_equity > 0 else None
+    roa = (total_net_income / avg_assets * 100) if avg_assets > 0 else None
+    
+    return {
+        "revenue_4q": round(total_revenue / 1e8, 2),  # 억원 단위
+        "net_income_4q": round(total_net_income / 1e8, 2),
+        "operating_income_4q": round(total_op_income / 1e8, 2),
+        "total_assets": round(avg_assets / 1e8, 2),
+        "total_equity": round(avg_equity / 1e8, 2),
+        "eps": latest_eps,
+        "roe_calculated": round(roe, 2) if roe else None,
+        "roa_calculated": round(roa, 2) if roa else None,
+        "quarters_available": len(rows)
+    }
+
+@taped("db_fundamental")
 def get_fundamental_from_db(ticker: str) -> Dict:
     """PostgreSQL에서 재무 데이터 조회"""
     try:
-        conn = get_postgres_connection()
-        cur = conn.cursor()
-        
-        # 종목 코드에서 .KS, .KQ 제거
-        code = ticker.split(".")[0]
-        
-        # 최근 4분기 재무 데이터 조회
-        query = """
-            SELECT 
-                f.revenue, f.net_income, f.operating_income, 
-                f.total_assets, f.total_equity, f.eps,
-                f.fiscal_quarter, f.period_end
-            FROM financial_statements f
-            JOIN stocks s ON f.stock_id = s.id
-            WHERE s.ticker = %s
-            ORDER BY f.period_end DESC
-            LIMIT 4
-        """
-        cur.execute(query, (code,))
-        rows = cur.fetchall()
-        conn.close()
-        
-        if not rows:
-            return {}
-        
-        # 최근 4분기 합산 및 평균
-        total_revenue = sum(r[0] or 0 for r in rows)
-        total_net_income = sum(r[1] or 0 for r in rows)
-        total_op_income = sum(r[2] or 0 for r in rows)
-        avg_assets = sum(r[3] or 0 for r in rows) / len(rows) if rows else 0
-        avg_equity = sum(r[4] or 0 for r in rows) / len(rows) if rows else 0
-        latest_eps = rows[0][5] if rows[0][5] else None
-        
-        # ROE, ROA 계산
-        roe = (total_net_income / avg_equity * 100) if avg_equity > 0 else None
-        roa = (total_net_income / avg_assets * 100) if avg_assets > 0 else None
-        
-        return {
-            "revenue_4q": round(total_revenue / 1e8, 2),  # 억원 단위
-            "net_income_4q": round(total_net_income / 1e8, 2),
-            "operating_income_4q": round(total_op_income / 1e8, 2),
-            "total_assets": round(avg_assets / 1e8, 2),
-            "total_equity": round(avg_equity / 1e8, 2),
-            "eps": latest_eps,
-            "roe_calculated": round(roe, 2) if roe else None,
-            "roa_calculated": round(roa, 2) if roa else None,
-            "quarters_available": len(rows)
-        }
+        with get_postgres_pool().connection() as conn:
+            cur = conn.cursor()
+            
+            # 종목 코드에서 .KS, .KQ 제거
+            code = ticker.split(".")[0]
+            
+            # 최근 4분기 재무 데이터 조회
+            query = """
+                SELECT 
+                    f.revenue, f.net_income, f.operating_income, 
+                    f.total_assets, f.total_equity, f.eps,
+                    f.fiscal_quarter, f.period_end
+                FROM financial_statements f
+                JOIN stocks s ON f.stock_id = s.id
+                WHERE s.ticker = %s
+                ORDER BY f.period_end DESC
+                LIMIT 4
+            """
+            cur.execute(query, (code,))
+            rows = cur.fetchall()
+        return _aggregate_fundamentals(rows)
     except Exception as e:
         print(f"[DB Error] {ticker}: {e}")
         return {}
 
+# 종목별 최근 4분기를 윈도우 함수로 한 번에 조회 (PostgreSQL / SQLite 3.25+ 공용)
+FUNDAMENTALS_BULK_QUERY = """
+    SELECT ticker, revenue, net_income, operating_income, total_assets, total_equity, eps, fiscal_quarter, period_end
+    FROM (
+        SELECT
+            s.ticker, f.revenue, f.net_income, f.operating_income,
+            f.total_assets, f.total_equity, f.eps,
+            f.fiscal_quarter, f.period_end,
+            ROW_NUMBER() OVER (PARTITION BY s.ticker ORDER BY f.period_end DESC) AS rn
+        FROM financial_statements f
+        JOIN stocks s ON f.stock_id = s.id
+        WHERE s.ticker IN ({placeholders})
+    ) recent
+    WHERE rn <= 4
+    ORDER BY ticker, period_end DESC
+"""
+
+def fetch_fundamentals_bulk(conn, tickers: List[str]) -> Dict[str, Dict]:
+    """DB-API 커넥션 하나로 전체 종목의 최근 4분기 재무 집계를 조회 (sqlite3 커넥션도 허용)"""
+    codes = sorted({t.split(".")[0] for t in tickers})
+    if not codes: return {}
+    placeholder = "?" if isinstance(conn, sqlite3.Connection) else "%s"
+    cur = conn.cursor()
+    with METRICS.timed("postgres"):
+        cur.execute(FUNDAMENTALS_BULK_QUERY.format(placeholders=", ".join([placeholder] * len(codes))), codes)
+        fetched = cur.fetchall()
+    grouped: Dict[str, List[Tuple]] = {}
+    for row in fetched:
+        grouped.setdefault(row[0], []).append(tuple(row[1:]))
+    return {t: _aggregate_fundamentals(grouped[t.split(".")[0]]) for t in tickers if t.split(".")[0] in grouped}
+
+@taped("db_fundamental_bulk", by_ticker=True)
+def get_fundamentals_bulk(tickers: List[str]) -> Dict[str, Dict]:
+    """marketsense DB에서 유니버스 전체 재무 데이터를 단일 왕복으로 조회"""
+    with get_postgres_pool().connection() as conn:
+        return fetch_fundamentals_bulk(conn, tickers)
+
 if LLM_PROVIDER == "gemini":
     LITE_MODEL = GEMINI_LITE_MODEL
     PRO_MODEL = GEMINI_PRO_MODEL
@@ -117,6 +408,12 @@ TRAJECTORY_K = 30
 
 SCORING_DIMENSIONS = ["financial_health", "growth_potential", "news_sentiment", "news_impact", "price_momentum", "volatility_risk"]
 
+class FallbackScores(dict):
+    """채점 실패 시의 기본 점수(전 차원 5점). 입력 지문 없이 저장되어 다음 실행에서 다시 채점된다"""
+
+def fallback_scores() -> FallbackScores:
+    return FallbackScores({d: 5 for d in SCORING_DIMENSIONS})
+
 # --- Helper Functions (Defined Early to avoid NameError) ---
 
 def _extract_json(text: str) -> Any:
@@ -124,83 +421,695 @@ def _extract_json(text: str) -> Any:
     if text.startswith("```"):
         text = re.sub(r"^```json\s*", "", text); text = re.sub(r"```$", "", text)
     match = re.search(r"(\{.*\}|\[.*\])", text, re.DOTALL)
-    if match: return json.loads(match.group(1))
-    raise ValueError("No JSON found")
+    try:
+        if match: return json.loads(match.group(1))
+        raise ValueError("No JSON found")
+    except ValueError:
+        METRICS.incr("json_parse_failures", "llm"); raise
 
-def _llm_chat(messages: List[Dict[str, str]], model: str = None, temperature=0.2) -> str:
-    if os.getenv("LLM_DISABLED", "0").strip() == "1": return "{}"
-    target_model = model if model else LITE_MODEL
+LLM_CACHE_PATH = os.path.join(STATE_DIR, "llm_cache.db")
+LLM_CACHE_ENABLED = os.getenv("LLM_CACHE", "1").strip() == "1"
+LLM_CACHE_MAX_BYTES = int(os.getenv("LLM_CACHE_MAX_BYTES", 64 * 1024 * 1024))
+# 모델별 캐시 유효기간(초). 전략(PRO)은 시장 상황에 민감하므로 짧게 유지
+LLM_CACHE_TTL = {LITE_MODEL: 7 * 86400, PRO_MODEL: 86400}
+LLM_CACHE_DEFAULT_TTL = 86400
+
+class LLMCache:
+    """(provider, model, temperature, messages) 해시 기반 LLM 응답 캐시 (SQLite, 용량 제한 LRU)"""
+    def __init__(self, path: str = LLM_CACHE_PATH, max_bytes: int = LLM_CACHE_MAX_BYTES, ttl: Optional[Dict[str, int]] = None):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.max_bytes = max_bytes
+        self.ttl = dict(LLM_CACHE_TTL, **(ttl or {}))
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0}
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS llm_cache (
+                key TEXT PRIMARY KEY, model TEXT, response TEXT,
+                size INTEGER, created_at REAL, last_access REAL
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_llm_cache_access ON llm_cache (last_access)")
+        self._conn.commit()
+        self._bytes = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM llm_cache").fetchone()[0]
+
+    @staticmethod
+    def make_key(provider: str, model: str, temperature: float, messages: List[Dict[str, str]]) -> str:
+        blob = json.dumps({"provider": provider, "model": model, "temperature": temperature, "messages": messages},
+                          ensure_ascii=False, sort_keys=True)
+        return hashlib.sha256(blob.encode("utf-8")).hexdigest()
+
+    def get(self, key: str, model: str) -> Optional[str]:
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute("SELECT response, created_at, size FROM llm_cache WHERE key = ?", (key,)).fetchone()
+            if row and now - row[1] > self.ttl.get(model, LLM_CACHE_DEFAULT_TTL):
+                self._conn.execute("DELETE FROM llm_cache WHERE key = ?", (key,)); self._conn.commit()
+                self._bytes -= row[2]; row = None
+            if row is None:
+                self.stats["misses"] += 1
+                return None
+            self._conn.execute("UPDATE llm_cache SET last_access = ? WHERE key = ?", (now, key)); self._conn.commit()
+            self.stats["hits"] += 1
+            return row[0]
+
+    def delete(self, key: str):
+        with self._lock:
+            row = self._conn.execute("SELECT size FROM llm_cache WHERE key = ?", (key,)).fetchone()
+            if row:
+                self._conn.execute("DELETE FROM llm_cache WHERE key = ?", (key,)); self._conn.commit()
+                self._bytes -= row[0]
+
+    def put(self, key: str, model: str, response: str):
+        size, now = len(response.encode("utf-8")), time.time()
+        with self._lock:
+            old = self._conn.execute("SELECT size FROM llm_cache WHERE key = ?", (key,)).fetchone()
+            self._conn.execute("INSERT OR REPLACE INTO llm_cache VALUES (?, ?, ?, ?, ?, ?)", (key, model, response, size, now, now))
+            self._bytes += size - (old[0] if old else 0)
+            # 가장 오래 사용되지 않은 항목부터 제거
+            while self._bytes > self.max_bytes:
+                victims = self._conn.execute("SELECT key, size FROM llm_cache ORDER BY last_access ASC LIMIT 64").fetchall()
+                if not victims: break
+                for k, sz in victims:
+                    if self._bytes <= self.max_bytes: break
+                    self._conn.execute("DELETE FROM llm_cache WHERE key = ?", (k,))
+                    self._bytes -= sz; self.stats["evictions"] += 1
+            self._conn.commit()
+
+_llm_cache: Optional[LLMCache] = None
+_llm_cache_lock = threading.Lock()
+
+def get_llm_cache() -> Optional[LLMCache]:
+    global _llm_cache
+    if not LLM_CACHE_ENABLED: return None
+    with _llm_cache_lock:
+        if _llm_cache is None: _llm_cache = LLMCache()
+        return _llm_cache
+
+# --- LLM Client (커넥션 풀, 속도 제한, 재시도) ---
+
+# 모델별 분당 요청 한도 (프로바이더 쿼터에 맞춰 조정)
+LLM_RPM = {LITE_MODEL: int(os.getenv("LLM_RPM_LITE", 300)), PRO_MODEL: int(os.getenv("LLM_RPM_PRO", 30))}
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", 60))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", 5))
+LLM_BACKOFF_BASE, LLM_BACKOFF_CAP = 1.0, 60.0
+LLM_HEDGE_AFTER = float(os.getenv("LLM_HEDGE_AFTER", 0))  # >0이면 이 시간(초) 안에 응답이 없을 때 중복 요청
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", 16))
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+
+class TokenBucket:
+    """초당 rate개씩 채워지는 토큰 버킷"""
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1.0, rate)
+        self._tokens, self._ts = self.capacity, time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._ts) * self.rate); self._ts = now
+
+    def try_acquire(self) -> bool:
+        with self._lock:
+            self._refill()
+            if self._tokens >= 1: self._tokens -= 1; return True
+            return False
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                self._refill()
+                if self._tokens >= 1: self._tokens -= 1; return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+class AIMDLimiter:
+    """동시 요청 수 제한. 성공하면 한도를 조금씩 올리고(가산), 스로틀되면 절반으로(승산) 줄인다"""
+    def __init__(self, initial: float = 4, minimum: float = 1, maximum: float = LLM_MAX_CONCURRENCY):
+        self.limit, self.minimum, self.maximum = float(initial), float(minimum), float(maximum)
+        self.inflight = 0
+        self._cond = threading.Condition()
+
+    def acquire(self):
+        with self._cond:
+            while self.inflight >= int(self.limit): self._cond.wait()
+            self.inflight += 1
+
+    def release(self, throttled: bool = False):
+        with self._cond:
+            self.inflight -= 1
+            if throttled: self.limit = max(self.minimum, self.limit / 2)
+            else: self.limit = min(self.maximum, self.limit + 1 / self.limit)
+            self._cond.notify_all()
+
+def _retry_after(res: requests.Response) -> Optional[float]:
+    value = res.headers.get("Retry-After")
+    if not value: return None
+    try: return max(0.0, float(value))
+    except ValueError: pass
+    try: return max(0.0, (parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds())
+    except Exception: return None
+
+class LLMClient:
+    """프로바이더 공용 HTTP 클라이언트: keep-alive 풀, 모델별 토큰 버킷, AIMD 동시성, Retry-After 존중 백오프, 선택적 hedging"""
+    def __init__(self, rpm: Optional[Dict[str, int]] = None, hedge_after: float = LLM_HEDGE_AFTER):
+        self.rpm = dict(LLM_RPM, **(rpm or {}))
+        self.hedge_after = hedge_after
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=2, pool_maxsize=LLM_MAX_CONCURRENCY * 2)
+        self.session.mount("https://", adapter)
+        self._buckets: Dict[str, TokenBucket] = {}
+        self._limiters: Dict[str, AIMDLimiter] = {}
+        self._lock = threading.Lock()
+        self._hedge_pool = ThreadPoolExecutor(max_workers=LLM_MAX_CONCURRENCY * 2, thread_name_prefix="llm-hedge") if hedge_after > 0 else None
+
+    def _for_model(self, model: str) -> Tuple[TokenBucket, AIMDLimiter]:
+        with self._lock:
+            if model not in self._buckets:
+                rate = self.rpm.get(model, 60) / 60.0
+                self._buckets[model] = TokenBucket(rate, capacity=max(1.0, rate * 5))
+                self._limiters[model] = AIMDLimiter()
+            return self._buckets[model], self._limiters[model]
+
+    def _send(self, bucket: TokenBucket, url: str, headers: Dict, payload: Dict, model: str) -> requests.Response:
+        post = lambda: self.session.post(url, headers=headers, json=payload, timeout=LLM_TIMEOUT)
+        if not self._hedge_pool: return post()
+        first = self._hedge_pool.submit(post)
+        done, _ = wait([first], timeout=self.hedge_after)
+        if done or not bucket.try_acquire(): return first.result()
+        METRICS.incr("hedges", f"llm:{model}")
+        done, _ = wait([first, self._hedge_pool.submit(post)], return_when=FIRST_COMPLETED)
+        return next(iter(done)).result()
+
+    def post(self, model: str, url: str, payload: Dict, headers: Optional[Dict] = None) -> Dict:
+        bucket, limiter = self._for_model(model)
+        for attempt in range(LLM_MAX_RETRIES + 1):
+            bucket.acquire(); limiter.acquire()
+            throttled, delay = False, None
+            try:
+                with METRICS.timed(urlparse(url).netloc): res = self._send(bucket, url, headers or {}, payload, model)
+                if res.status_code not in RETRYABLE_STATUS:
+                    res.raise_for_status()
+                    return res.json()
+                throttled = res.status_code in (429, 503)
+                delay = _retry_after(res)
+                if attempt == LLM_MAX_RETRIES: res.raise_for_status()
+            except (requests.ConnectionError, requests.Timeout):
+                if attempt == LLM_MAX_RETRIES: raise
+            finally:
+                limiter.release(throttled)
+            METRICS.incr("retries", f"llm:{model}")
+            # Retry-After가 없으면 full-jitter 지수 백오프
+            time.sleep(delay if delay is not None else random.uniform(0, min(LLM_BACKOFF_CAP, LLM_BACKOFF_BASE * 2 ** attempt)))
+        raise RuntimeError(f"LLM request to {model} failed after {LLM_MAX_RETRIES} retries")
+
+_llm_client: Optional[LLMClient] = None
+_llm_client_lock = threading.Lock()
+
+def get_llm_client() -> LLMClient:
+    global _llm_client
+    with _llm_client_lock:
+        if _llm_client is None: _llm_client = LLMClient()
+        return _llm_client
+
+@taped("llm", stub=_stub_llm)
+def _llm_request(messages: List[Dict[str, str]], model: str, temperature: float) -> Optional[str]:
+    """프로바이더 API 호출. API 키가 없으면 None"""
     if LLM_PROVIDER == "gemini":
-        if not GEMINI_API_KEY: return "{}"
+        if not GEMINI_API_KEY: return None
         prompt = "\n".join([m['content'] for m in messages])
-        url = f"https://generativelanguage.googleapis.com/v1beta/models/{target_model}:generateContent?key={GEMINI_API_KEY}"
+        url = f"https://generativelanguage.googleapis.com/v1beta/models/{model}:generateContent?key={GEMINI_API_KEY}"
         payload = {"contents": [{"parts": [{"text": prompt}]}], "generationConfig": {"temperature": temperature}}
-        res = requests.post(url, json=payload, timeout=60); res.raise_for_status()
-        return res.json()["candidates"][0]["content"]["parts"][0]["text"]
+        body = get_llm_client().post(model, url, payload); usage = body.get("usageMetadata", {})
+        METRICS.observe_llm(model, prompt_tokens=usage.get("promptTokenCount", 0), completion_tokens=usage.get("candidatesTokenCount", 0))
+        return body["candidates"][0]["content"]["parts"][0]["text"]
     else:
-        if not OPENAI_API_KEY: return "{}"
+        if not OPENAI_API_KEY: return None
         url = "https://api.openai.com/v1/chat/completions"
         headers = {"Authorization": f"Bearer {OPENAI_API_KEY}", "Content-Type": "application/json"}
-        payload = {"model": target_model, "messages": messages, "temperature": temperature}
-        res = requests.post(url, headers=headers, json=payload, timeout=60); res.raise_for_status()
-        return res.json()["choices"][0]["message"]["content"]
+        payload = {"model": model, "messages": messages, "temperature": temperature}
+        body = get_llm_client().post(model, url, payload, headers); usage = body.get("usage", {})
+        METRICS.observe_llm(model, prompt_tokens=usage.get("prompt_tokens", 0), completion_tokens=usage.get("completion_tokens", 0))
+        return body["choices"][0]["message"]["content"]
+
+def _llm_chat(messages: List[Dict[str, str]], model: str = None, temperature=0.2, parse=None) -> Any:
+    """LLM 응답 텍스트. parse가 주어지면 파싱 결과를 반환하고, 파싱에 성공한 응답만 캐시한다"""
+    if os.getenv("LLM_DISABLED", "0").strip() == "1": return parse("{}") if parse else "{}"
+    target_model = model if model else LITE_MODEL
+    cache = get_llm_cache()
+    key = LLMCache.make_key(LLM_PROVIDER, target_model, temperature, messages) if cache else None
+    if cache:
+        cached = cache.get(key, target_model)
+        if cached is not None and parse is None: return cached
+        if cached is not None:
+            try: return parse(cached)
+            except ValueError: cache.delete(key)  # 이전에 캐시된 손상 응답은 버리고 다시 요청
+    t0 = time.perf_counter()
+    try:
+        text = _llm_request(messages, target_model, temperature)
+    except Exception:
+        METRICS.incr("failures", f"llm:{target_model}"); raise
+    finally:
+        METRICS.observe_llm(target_model, seconds=time.perf_counter() - t0, calls=1)
+    if text is None: return parse("{}") if parse else "{}"
+    result = parse(text) if parse else text  # 파싱 실패(ValueError)는 캐시하지 않고 호출자에게 전달
+    if cache: cache.put(key, target_model, text)
+    return result
 
 # --- 1. RDB Data Collection Pipeline (SQLite) ---
 
+RAW_KEYS = ['technical', 'fundamental', 'dart', 'investor', 'news']
+
+def input_fingerprint(raw: Dict) -> str:
+    """채점 입력(원천 데이터 5종 + 채점 모델)의 해시. 같으면 이전 점수를 재사용"""
+    blob = json.dumps({"model": LITE_MODEL, **{k: raw.get(k) for k in RAW_KEYS}}, ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.sha256(blob.encode("utf-8")).hexdigest()
+
+# 정형 컬럼: (raw 섹션, 필드, SQL 타입). 컬럼으로 손실 없이 옮길 수 없는 값은 extra(JSON)에 보존
+SNAPSHOT_FIELDS = [
+    ("technical", "price", "INTEGER"), ("technical", "weekly_return", "REAL"), ("technical", "macd", "TEXT"),
+    ("technical", "vol_spike", "REAL"), ("technical", "is_bullish", "BOOLEAN"),
+    ("fundamental", "per", "REAL"), ("fundamental", "pbr", "REAL"), ("fundamental", "roe", "REAL"), ("fundamental", "target_price", "REAL"),
+    ("fundamental", "revenue_4q", "REAL"), ("fundamental", "net_income_4q", "REAL"), ("fundamental", "operating_income_4q", "REAL"),
+    ("fundamental", "total_assets", "REAL"), ("fundamental", "total_equity", "REAL"), ("fundamental", "eps", "REAL"),
+    ("fundamental", "roe_calculated", "REAL"), ("fundamental", "roa_calculated", "REAL"), ("fundamental", "quarters_available", "INTEGER"),
+    ("investor", "foreign_net", "INTEGER"), ("investor", "institution_net", "INTEGER"),
+    ("dart", "debt_ratio", "REAL"),
+]
+# 문자열로 수집되는 수치 필드: (인코더, 디코더)
+_FORMATTED_FIELDS = {
+    "target_price": (lambda v: float(v), lambda x: str(int(x))),
+    "debt_ratio": (lambda v: float(v.rstrip("%")), lambda x: f"{x}%"),
+}
+_DART_ACCOUNTS = [("매출액", "revenue"), ("영업이익", "operating_income"), ("당기순이익", "net_income")]
+_SNAPSHOT_COLUMNS = ["ticker", "asof_date", "name", "timestamp"] + [f for _, f, _ in SNAPSHOT_FIELDS] + ["extra", "input_hash"]
+_SNAPSHOT_UPDATE = ", ".join(f"{c} = excluded.{c}" for c in _SNAPSHOT_COLUMNS[2:])
+
+def _decode_field(field: str, sql_type: str, x):
+    if field in _FORMATTED_FIELDS: return _FORMATTED_FIELDS[field][1](x)
+    return bool(x) if sql_type == "BOOLEAN" else x
+
+def _encode_field(field: str, sql_type: str, v):
+    """컬럼 값으로 변환. 디코딩 결과가 원본과 다르면 None (원본은 extra로)"""
+    try:
+        if field in _FORMATTED_FIELDS: x = _FORMATTED_FIELDS[field][0](v)
+        elif sql_type == "TEXT": x = v if isinstance(v, str) else None
+        elif isinstance(v, bool): x = int(v) if sql_type == "BOOLEAN" else None
+        else: x = v if isinstance(v, (int, float)) and v == v else None
+    except (TypeError, ValueError, AttributeError):
+        return None
+    return x if x is not None and _decode_field(field, sql_type, x) == v else None
+
+def _dart_quarter(row: Tuple) -> Dict[str, str]:
+    q = {"Period": row[0]}
+    for (acc, _), amount in zip(_DART_ACCOUNTS, row[1:]): q[acc] = f"{amount:,}" if amount is not None else "N/A"
+    return q
+
+def _dart_rows(trend) -> Optional[List[Tuple]]:
+    """분기 추이를 (period, 매출액, 영업이익, 당기순이익) 행으로. 손실 없이 되돌릴 수 없으면 None"""
+    def _amount(v):
+        try: return int(str(v).replace(",", ""))
+        except ValueError: return None
+    try: rows = [(q["Period"], *(_amount(q.get(acc)) for acc, _ in _DART_ACCOUNTS)) for q in trend]
+    except (TypeError, KeyError): return None
+    return rows if rows and [_dart_quarter(r) for r in rows] == trend else None
+
+def encode_snapshot(data: Dict) -> Tuple[Dict[str, Any], List[str], List[Tuple]]:
+    """raw dict → (정형 컬럼, 뉴스 목록, DART 분기 행)"""
+    row = {"ticker": data['ticker'], "name": data['name']}
+    extra = {k: dict(v) if isinstance(v, dict) else v for k, v in ((k, data.get(k)) for k in RAW_KEYS if k != 'news')}
+    for section, field, sql_type in SNAPSHOT_FIELDS:
+        if not isinstance(extra[section], dict) or field not in extra[section]: row[field] = None; continue
+        row[field] = _encode_field(field, sql_type, extra[section][field])
+        if row[field] is not None: del extra[section][field]
+    dart = _dart_rows(extra["dart"].get("quarterly_trend")) if isinstance(extra["dart"], dict) else None
+    if dart: del extra["dart"]["quarterly_trend"]
+    news = data.get('news')
+    if isinstance(news, list) and all(isinstance(n, str) for n in news): news = list(news)
+    else: extra["news"], news = news, []
+    extra = {k: v for k, v in extra.items() if v != {}}
+    row["extra"] = json.dumps(extra, ensure_ascii=False) if extra else None
+    return row, news, dart or []
+
+def decode_snapshot(row: Dict, news: List[str], dart: List[Tuple]) -> Dict:
+    """encode_snapshot의 역변환"""
+    res = {k: row[k] for k in ("ticker", "asof_date", "name", "timestamp", "input_hash", "scores_hash") if k in row}
+    res['scores'] = json.loads(row['scores']) if row.get('scores') else None
+    sections = {k: {} for k in RAW_KEYS}
+    for section, field, sql_type in SNAPSHOT_FIELDS:
+        if row.get(field) is not None: sections[section][field] = _decode_field(field, sql_type, row[field])
+    if dart: sections['dart']['quarterly_trend'] = [_dart_quarter(r) for r in dart]
+    sections['news'] = list(news)
+    for k, v in (json.loads(row['extra']) if row.get('extra') else {}).items():
+        if isinstance(v, dict) and isinstance(sections[k], dict): sections[k].update(v)
+        else: sections[k] = v
+    res.update(sections)
+    return res
+
+PARQUET_DIR = os.path.join(STATE_DIR, "parquet")
+
 class StockDatabase:
-    """SQLite 기반의 원천 데이터베이스 관리 클래스"""
-    def __init__(self, db_path):
+    """SQLite(WAL) 기반의 원천 데이터베이스 관리 클래스
+
+    (ticker, asof_date) 단위 스냅샷을 stock_snapshot에 정형 컬럼으로 저장하고,
+    뉴스와 DART 분기 추이는 별도 테이블에 둔다. 연결은 인스턴스 수명 동안 유지하며
+    쓰기는 큐에 넣어 단일 writer 스레드가 모아서 한 트랜잭션으로 커밋한다.
+
+    run_ledger는 거래일별 종목 단계(collected, scored) 완료를, run_checkpoints는 실행 단위
+    단계(universe, strategy, selection)의 결과를 기록한다. 데이터와 같은 트랜잭션으로
+    커밋되므로 중단된 실행은 기록된 지점부터 이어서 진행할 수 있다.
+    """
+    WRITE_BATCH = 64
+
+    def __init__(self, db_path, asof_date: Optional[str] = None):
         self.db_path = db_path
+        self.asof_date = asof_date or datetime.now().strftime("%Y-%m-%d")
         os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self._conn = self._connect()
+        self._read_lock = threading.Lock()
         self.init_db()
+        self._queue: "queue.Queue[Optional[Tuple]]" = queue.Queue()
+        self._writer = threading.Thread(target=self._write_loop, name="db-writer", daemon=True)
+        self._writer.start()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.db_path, check_same_thread=False, timeout=30)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
 
     def init_db(self):
-        with sqlite3.connect(self.db_path) as conn:
-            conn.execute("""
-                CREATE TABLE IF NOT EXISTS raw_data (
-                    ticker TEXT PRIMARY KEY,
-                    name TEXT,
-                    timestamp TEXT,
-                    technical TEXT,
-                    fundamental TEXT,
-                    dart TEXT,
-                    investor TEXT,
-                    news TEXT
-                )
-            """)
-            conn.commit()
+        conn = self._conn
+        tables = {r[0] for r in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+        fields = ",\n".join(f"                {f} {t}" for _, f, t in SNAPSHOT_FIELDS)
+        conn.execute(f"""
+            CREATE TABLE IF NOT EXISTS stock_snapshot (
+                ticker TEXT NOT NULL,
+                asof_date TEXT NOT NULL,
+                name TEXT,
+                timestamp TEXT,
+{fields},
+                extra TEXT,
+                input_hash TEXT,
+                scores TEXT,
+                scores_hash TEXT,
+                PRIMARY KEY (ticker, asof_date)
+            )
+        """)
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_snapshot_asof ON stock_snapshot (asof_date, ticker)")
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS snapshot_news (
+                ticker TEXT NOT NULL, asof_date TEXT NOT NULL, seq INTEGER NOT NULL, headline TEXT,
+                PRIMARY KEY (ticker, asof_date, seq)
+            )
+        """)
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS snapshot_dart (
+                ticker TEXT NOT NULL, asof_date TEXT NOT NULL, seq INTEGER NOT NULL,
+                period TEXT, revenue INTEGER, operating_income INTEGER, net_income INTEGER,
+                PRIMARY KEY (ticker, asof_date, seq)
+            )
+        """)
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS run_ledger (
+                asof_date TEXT NOT NULL, ticker TEXT NOT NULL, stage TEXT NOT NULL, updated_at TEXT,
+                PRIMARY KEY (asof_date, ticker, stage)
+            )
+        """)
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS run_checkpoints (
+                asof_date TEXT NOT NULL, stage TEXT NOT NULL, payload TEXT, updated_at TEXT,
+                PRIMARY KEY (asof_date, stage)
+            )
+        """)
+        if "stock_snapshot" not in tables: self._migrate_legacy(conn, tables)
+        conn.commit()
+
+    def _migrate_legacy(self, conn: sqlite3.Connection, tables: set):
+        """JSON 컬럼 스키마(raw_data, raw_data_history)에서 1회 이전. 기존 테이블은 그대로 둔다"""
+        rows = []
+        conn.row_factory = sqlite3.Row
+        if "raw_data_history" in tables:
+            rows += [dict(r) for r in conn.execute("SELECT * FROM raw_data_history")]
+        if "raw_data" in tables:
+            seen = {(r['ticker'], r['asof_date']) for r in rows}
+            for r in map(dict, conn.execute("SELECT * FROM raw_data")):
+                r['asof_date'] = (r.get('timestamp') or self.asof_date)[:10]
+                if (r['ticker'], r['asof_date']) not in seen: rows.append(r)
+        conn.row_factory = None
+        for r in rows:
+            try: data = {**r, **{k: json.loads(r[k]) for k in RAW_KEYS}}
+            except (TypeError, ValueError): continue
+            self._apply(conn, ("upsert", r['asof_date'], data, r.get('timestamp'), r.get('input_hash') or input_fingerprint(data)))
+            if r.get('scores'): self._apply(conn, ("scores", r['asof_date'], r['ticker'], r['scores'], r.get('scores_hash')))
+        if rows: print(f"[DB] migrated {len(rows)} legacy rows to stock_snapshot")
+
+    # --- writer ---
+
+    def _write_loop(self):
+        conn = self._connect()
+        while True:
+            item = self._queue.get()
+            batch = [item]
+            while item is not None and len(batch) < self.WRITE_BATCH:
+                try: item = self._queue.get_nowait()
+                except queue.Empty: break
+                batch.append(item)
+            ops = [op for op in batch if op is not None]
+            try:
+                # 배치 전체를 한 트랜잭션으로 커밋. 작업마다 중첩 SAVEPOINT를 두어 실패한 작업만 되돌린다
+                conn.execute("BEGIN")
+                for op in ops:
+                    conn.execute("SAVEPOINT op")
+                    try: self._apply(conn, op)
+                    except Exception as e:
+                        conn.execute("ROLLBACK TO op")
+                        METRICS.incr("failures", "db_write"); print(f"[DB Write Error] {op[0]}: {e}")
+                    conn.execute("RELEASE op")
+                conn.commit()
+            except Exception as e:
+                if conn.in_transaction: conn.rollback()
+                METRICS.incr("failures", "db_write"); print(f"[DB Write Error] {e}")
+            for _ in batch: self._queue.task_done()
+            if len(ops) < len(batch):
+                conn.close(); return
+
+    def _apply(self, conn: sqlite3.Connection, op: Tuple):
+        kind, args = op[0], op[1:]
+        if kind == "upsert":
+            asof_date, data, timestamp, fingerprint = args
+            row, news, dart = encode_snapshot(data)
+            row.update(asof_date=asof_date, timestamp=timestamp, input_hash=fingerprint)
+            # 점수 컬럼은 보존 (input_hash가 바뀌면 다음 분석에서 재채점)
+            conn.execute(f"INSERT INTO stock_snapshot ({', '.join(_SNAPSHOT_COLUMNS)}) VALUES ({', '.join('?' * len(_SNAPSHOT_COLUMNS))}) "
+                         f"ON CONFLICT(ticker, asof_date) DO UPDATE SET {_SNAPSHOT_UPDATE}", [row[c] for c in _SNAPSHOT_COLUMNS])
+            key = (data['ticker'], asof_date)
+            conn.execute("DELETE FROM snapshot_news WHERE ticker = ? AND asof_date = ?", key)
+            conn.executemany("INSERT INTO snapshot_news VALUES (?, ?, ?, ?)", [(*key, i, h) for i, h in enumerate(news)])
+            conn.execute("DELETE FROM snapshot_dart WHERE ticker = ? AND asof_date = ?", key)
+            conn.executemany("INSERT INTO snapshot_dart VALUES (?, ?, ?, ?, ?, ?, ?)", [(*key, i, *q) for i, q in enumerate(dart)])
+            conn.execute("INSERT OR REPLACE INTO run_ledger VALUES (?, ?, 'collected', ?)", (asof_date, data['ticker'], timestamp))
+        elif kind == "scores":
+            asof_date, ticker, scores, fingerprint = args
+            conn.execute("UPDATE stock_snapshot SET scores = ?, scores_hash = ? WHERE ticker = ? AND asof_date = ?",
+                         (scores, fingerprint, ticker, asof_date))
+            conn.execute("INSERT OR REPLACE INTO run_ledger VALUES (?, ?, 'scored', ?)", (asof_date, ticker, datetime.now().isoformat()))
+        elif kind == "checkpoint":
+            asof_date, stage, payload = args
+            conn.execute("INSERT OR REPLACE INTO run_checkpoints VALUES (?, ?, ?, ?)", (asof_date, stage, payload, datetime.now().isoformat()))
+        elif kind == "reset_run":
+            conn.execute("DELETE FROM run_ledger WHERE asof_date = ?", args)
+            conn.execute("DELETE FROM run_checkpoints WHERE asof_date = ?", args)
 
     def update_stock(self, data: Dict):
-        with sqlite3.connect(self.db_path) as conn:
-            conn.execute("""
-                INSERT OR REPLACE INTO raw_data 
-                (ticker, name, timestamp, technical, fundamental, dart, investor, news)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-            """, (
-                data['ticker'], data['name'], datetime.now().isoformat(),
-                json.dumps(data['technical'], ensure_ascii=False),
-                json.dumps(data['fundamental'], ensure_ascii=False),
-                json.dumps(data['dart'], ensure_ascii=False),
-                json.dumps(data['investor'], ensure_ascii=False),
-                json.dumps(data['news'], ensure_ascii=False)
-            ))
-            conn.commit()
+        self._queue.put(("upsert", self.asof_date, data, datetime.now().isoformat(), input_fingerprint(data)))
+
+    def save_scores(self, ticker: str, scores: Dict[str, int], fingerprint: str):
+        # 기본 점수는 지문 없이 저장해 재사용되지 않게 한다
+        if isinstance(scores, FallbackScores): fingerprint = None
+        self._queue.put(("scores", self.asof_date, ticker, json.dumps(scores), fingerprint))
+
+    def checkpoint(self, stage: str, payload: Any):
+        """실행 단위 단계 결과 기록 (JSON 직렬화 가능한 값)"""
+        self._queue.put(("checkpoint", self.asof_date, stage, json.dumps(payload, ensure_ascii=False)))
+
+    def reset_run(self):
+        """해당 일자의 진행 기록을 지워 처음부터 다시 실행 (수집 데이터와 점수는 유지)"""
+        self._queue.put(("reset_run", self.asof_date))
+
+    def flush(self):
+        """대기 중인 쓰기가 모두 커밋될 때까지 대기"""
+        self._queue.join()
+
+    def close(self):
+        if self._writer.is_alive():
+            self._queue.put(None); self._writer.join()
+        self._conn.close()
+
+    # --- reader ---
+
+    def _query(self, sql: str, params: Tuple = ()) -> List[sqlite3.Row]:
+        self.flush()
+        with self._read_lock:
+            self._conn.row_factory = sqlite3.Row
+            return self._conn.execute(sql, params).fetchall()
+
+    def _load(self, where: str, params: Tuple = ()) -> Dict[str, Dict]:
+        """조건에 맞는 스냅샷 행과 뉴스/DART 측면 테이블을 모아 raw dict로 복원 (ticker 키)"""
+        keys = f"SELECT ticker, asof_date FROM stock_snapshot WHERE {where}"
+        news, dart = {}, {}
+        for r in self._query(f"SELECT ticker, asof_date, headline FROM snapshot_news JOIN ({keys}) USING (ticker, asof_date) ORDER BY seq", params):
+            news.setdefault((r['ticker'], r['asof_date']), []).append(r['headline'])
+        for r in self._query(f"SELECT * FROM snapshot_dart JOIN ({keys}) USING (ticker, asof_date) ORDER BY seq", params):
+            dart.setdefault((r['ticker'], r['asof_date']), []).append((r['period'], r['revenue'], r['operating_income'], r['net_income']))
+        return {r['ticker']: decode_snapshot(dict(r), news.get((r['ticker'], r['asof_date']), []), dart.get((r['ticker'], r['asof_date']), []))
+                for r in self._query(f"SELECT * FROM stock_snapshot WHERE {where}", params)}
 
     def get_stock(self, ticker: str) -> Optional[Dict]:
-        with sqlite3.connect(self.db_path) as conn:
-            conn.row_factory = sqlite3.Row
-            cur = conn.execute("SELECT * FROM raw_data WHERE ticker = ?", (ticker,))
-            row = cur.fetchone()
-            if row:
-                res = dict(row)
-                for key in ['technical', 'fundamental', 'dart', 'investor', 'news']:
-                    res[key] = json.loads(res[key])
-                return res
-        return None
+        """종목의 가장 최근 스냅샷"""
+        return self._load("ticker = ? AND asof_date = (SELECT MAX(asof_date) FROM stock_snapshot WHERE ticker = ?)", (ticker, ticker)).get(ticker)
+
+    def ledger(self, tickers: Optional[List[str]] = None) -> Dict[str, set]:
+        """해당 일자에 완료된 종목별 단계 {ticker: {"collected", "scored"}}"""
+        sql, params = "SELECT ticker, stage FROM run_ledger WHERE asof_date = ?", [self.asof_date]
+        if tickers is not None:
+            if not tickers: return {}
+            sql += f" AND ticker IN ({', '.join('?' * len(tickers))})"; params += list(tickers)
+        done: Dict[str, set] = {}
+        for r in self._query(sql, tuple(params)): done.setdefault(r['ticker'], set()).add(r['stage'])
+        return done
+
+    def get_checkpoint(self, stage: str) -> Any:
+        rows = self._query("SELECT payload FROM run_checkpoints WHERE asof_date = ? AND stage = ?", (self.asof_date, stage))
+        return json.loads(rows[0]['payload']) if rows else None
+
+    def latest_asof(self) -> Optional[str]:
+        rows = self._query("SELECT MAX(asof_date) AS asof FROM stock_snapshot")
+        return rows[0]['asof'] if rows else None
+
+    def get_scores(self, tickers: List[str]) -> Dict[str, Tuple[Optional[Dict[str, int]], Optional[str]]]:
+        """최근 채점 결과와 그때의 입력 지문 {ticker: (scores, scores_hash)}"""
+        if not tickers: return {}
+        rows = self._query(f"""
+            SELECT ticker, scores, scores_hash FROM stock_snapshot s
+            WHERE ticker IN ({', '.join('?' * len(tickers))}) AND scores IS NOT NULL
+              AND asof_date = (SELECT MAX(asof_date) FROM stock_snapshot WHERE ticker = s.ticker AND scores IS NOT NULL)
+        """, tuple(tickers))
+        return {r['ticker']: (json.loads(r['scores']), r['scores_hash']) for r in rows}
+
+    def get_stocks(self, tickers: Optional[List[str]] = None, asof_date: Optional[str] = None) -> Dict[str, Dict]:
+        """해당 일자의 스냅샷 조회 (tickers가 없으면 전체)"""
+        where, params = "asof_date = ?", [asof_date or self.asof_date]
+        if tickers is not None:
+            if not tickers: return {}
+            where += f" AND ticker IN ({', '.join('?' * len(tickers))})"; params += list(tickers)
+        return self._load(where, tuple(params))
+
+    def screen(self, where: str, params: Tuple = (), asof_date: Optional[str] = None) -> List[Dict]:
+        """정형 컬럼에 대한 SQL 조건으로 해당 일자 종목 조회. 예: screen("vol_spike > ? AND pbr < ?", (2, 1))"""
+        cols = ", ".join(["ticker", "name"] + [f for _, f, _ in SNAPSHOT_FIELDS])
+        return [dict(r) for r in self._query(f"SELECT {cols} FROM stock_snapshot WHERE asof_date = ? AND ({where}) ORDER BY ticker",
+                                             (asof_date or self.asof_date, *params))]
+
+    def export_parquet(self, asof_date: Optional[str] = None, out_dir: str = PARQUET_DIR) -> str:
+        """해당 일자 스냅샷을 Parquet로 내보낸다: {out_dir}/asof=YYYY-MM-DD/{stocks,news,dart}.parquet
+
+        점수는 score_<차원> 정수 컬럼으로 펼친다. 읽기는 read_snapshot(memory_map) 사용.
+        """
+        asof = asof_date or self.asof_date
+        types = {"INTEGER": pa.int64(), "REAL": pa.float64(), "TEXT": pa.string(), "BOOLEAN": pa.bool_()}
+        cols = [f for _, f, _ in SNAPSHOT_FIELDS]
+        rows = self._query(f"SELECT ticker, name, {', '.join(cols)}, scores FROM stock_snapshot WHERE asof_date = ? ORDER BY ticker", (asof,))
+        scores = [json.loads(r['scores']) if r['scores'] else {} for r in rows]
+        stocks = pa.table(
+            {"ticker": [r['ticker'] for r in rows], "name": [r['name'] for r in rows],
+             **{f: pa.array([None if r[f] is None else _decode_field(f, t, r[f]) if t == "BOOLEAN" else r[f] for r in rows], types[t])
+                for _, f, t in SNAPSHOT_FIELDS},
+             **{f"score_{d}": pa.array([s.get(d) for s in scores], pa.int64()) for d in SCORING_DIMENSIONS}})
+        news = self._query("SELECT ticker, seq, headline FROM snapshot_news WHERE asof_date = ? ORDER BY ticker, seq", (asof,))
+        dart = self._query("SELECT ticker, seq, period, revenue, operating_income, net_income FROM snapshot_dart WHERE asof_date = ? ORDER BY ticker, seq", (asof,))
+        path = os.path.join(out_dir, f"asof={asof}")
+        os.makedirs(path, exist_ok=True)
+        for name, table in [("stocks", stocks),
+                            ("news", pa.table({k: [r[k] for r in news] for k in ("ticker", "seq", "headline")})),
+                            ("dart", pa.table({k: pa.array([r[k] for r in dart], pa.string() if k in ("ticker", "period") else pa.int64())
+                                               for k in ("ticker", "seq", "period", "revenue", "operating_income", "net_income")}))]:
+            tmp = os.path.join(path, f".{name}.parquet.tmp")
+            pq.write_table(table, tmp, compression="zstd")
+            os.replace(tmp, os.path.join(path, f"{name}.parquet"))
+        return path
+
+def read_snapshot(asof_date: Optional[str] = None, table: str = "stocks", columns: Optional[List[str]] = None,
+                  filters=None, root: str = PARQUET_DIR):
+    """내보낸 Parquet 스냅샷을 memory-map으로 읽는다 (pyarrow.Table). asof_date가 없으면 최신 일자
+
+    예: read_snapshot(filters=[("vol_spike", ">", 2), ("pbr", "<", 1)]).to_pandas()
+    """
+    if asof_date is None:
+        dates = sorted(d[len("asof="):] for d in os.listdir(root) if d.startswith("asof="))
+        if not dates: raise FileNotFoundError(f"no parquet snapshot under {root}")
+        asof_date = dates[-1]
+    return pq.read_table(os.path.join(root, f"asof={asof_date}", f"{table}.parquet"), columns=columns, filters=filters, memory_map=True)
+
+DART_CACHE_PATH = os.path.join(STATE_DIR, "dart_cache.db")
+DART_NEGATIVE_TTL = int(os.getenv("DART_NEGATIVE_TTL", 6 * 3600))  # 미제출 보고서 재조회 간격(초)
+
+class DartCache:
+    """(corp, year, reprt_code, kind) 단위 DART 응답 영구 캐시
+
+    제출된 보고서는 바뀌지 않으므로 만료 없이 보관하고, 아직 제출되지 않은
+    보고서(빈 응답)는 negative_ttl 동안만 기억한다.
+    """
+    COLUMNS = ['account_nm', 'thstrm_amount']
+
+    def __init__(self, path: str = DART_CACHE_PATH, negative_ttl: int = DART_NEGATIVE_TTL):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.negative_ttl = negative_ttl
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS dart_filings (
+                corp TEXT, year INTEGER, reprt_code TEXT, kind TEXT,
+                payload TEXT, fetched_at REAL,
+                PRIMARY KEY (corp, year, reprt_code, kind)
+            )
+        """)
+        self._conn.commit()
+
+    def get(self, corp: str, year: int, reprt_code: str, kind: str) -> Tuple[bool, Optional[pd.DataFrame]]:
+        """(캐시 적중 여부, DataFrame 또는 미제출이면 None)"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT payload, fetched_at FROM dart_filings WHERE corp = ? AND year = ? AND reprt_code = ? AND kind = ?",
+                (corp, year, reprt_code, kind)).fetchone()
+        if row is None: return False, None
+        payload, fetched_at = row
+        if payload is None:
+            return (time.time() - fetched_at) < self.negative_ttl, None
+        return True, pd.DataFrame(json.loads(payload), columns=self.COLUMNS)
+
+    def put(self, corp: str, year: int, reprt_code: str, kind: str, df: Optional[pd.DataFrame]):
+        payload = None
+        if df is not None and not df.empty:
+            payload = df.reindex(columns=self.COLUMNS).astype(str).to_json(orient="records", force_ascii=False)
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO dart_filings VALUES (?, ?, ?, ?, ?, ?)",
+                               (corp, year, reprt_code, kind, payload, time.time()))
+            self._conn.commit()
 
 class DartFinancialCollector:
-    def __init__(self, api_key):
+    def __init__(self, api_key, cache: Optional[DartCache] = None):
         self.dart = OpenDartReader(api_key)
+        self.cache = cache if cache is not None else DartCache()
+
+    def _report(self, kind: str, corp_name: str, year: int, code: str) -> Optional[pd.DataFrame]:
+        # kind: 'finstate' | 'finstate_all'. 네트워크/쿼터 오류는 캐시하지 않고 그대로 전파
+        hit, df = self.cache.get(corp_name, year, code, kind)
+        if hit: return df
+        df = getattr(self.dart, kind)(corp_name, year, reprt_code=code)
+        self.cache.put(corp_name, year, code, kind, df)
+        return df
+
     def get_summary(self, corp_name):
         try:
             current_year = datetime.now().year
@@ -208,7 +1117,7 @@ class DartFinancialCollector:
             summary_list, debt_ratio = [], "N/A"
             for year, code in reports:
                 try:
-                    df_fin = self.dart.finstate(corp_name, year, reprt_code=code)
+                    df_fin = self._report('finstate', corp_name, year, code)
                     if df_fin is not None and not df_fin.empty:
                         m = {"Period": f"{year}.{code}"}
                         for acc in ['매출액', '영업이익', '당기순이익']:
@@ -218,66 +1127,605 @@ class DartFinancialCollector:
                                 m[acc] = f"{int(val):,}" if val and val != '-' else "N/A"
                         summary_list.append(m)
                     if debt_ratio == "N/A":
-                        df_all = self.dart.finstate_all(corp_name, year, reprt_code=code)
+                        df_all = self._report('finstate_all', corp_name, year, code)
                         if df_all is not None and not df_all.empty:
                             debt = df_all[df_all['account_nm'].str.contains('부채총계', na=False)]
                             equity = df_all[df_all['account_nm'].str.contains('자본총계', na=False)]
                             if not debt.empty and not equity.empty:
                                 debt_ratio = f"{round((float(str(debt.iloc[0]['thstrm_amount']).replace(',','')) / float(str(equity.iloc[0]['thstrm_amount']).replace(',',''))) * 100, 2)}%"
-                except: continue
+                except Exception: METRICS.incr("failures", "dart_report"); continue
                 if len(summary_list) >= 4: break
             return {"quarterly_trend": summary_list, "debt_ratio": debt_ratio}
-        except: return {"error": "DART lookup failed"}
+        except Exception:
+            METRICS.incr("failures", "dart"); return {"error": "DART lookup failed"}
+
+_dart_collector: Optional[DartFinancialCollector] = None
+_dart_collector_lock = threading.Lock()
+
+def get_dart_collector() -> DartFinancialCollector:
+    """프로세스 전체에서 공유하는 DART 수집기 (OpenDartReader 초기화는 1회)"""
+    global _dart_collector
+    with _dart_collector_lock:
+        if _dart_collector is None: _dart_collector = DartFinancialCollector(DART_API_KEY)
+        return _dart_collector
+
+# 호스트별 동시 요청 한도 (블로킹 라이브러리는 가상 호스트 키 사용)
+HOST_LIMITS = {"finance.naver.com": 8, "m.stock.naver.com": 8, "yfinance": 4, "opendart.fss.or.kr": 4, "postgres": 4, "krx": 4}
+HTTP_HEADERS = {"User-Agent": "Mozilla/5.0"}
+
+_http_sessions: Dict[str, requests.Session] = {}
+_http_lock = threading.Lock()
+
+def _http_session(host: str) -> requests.Session:
+    """호스트별 keep-alive 세션 (커넥션 풀 재사용)"""
+    with _http_lock:
+        sess = _http_sessions.get(host)
+        if sess is None:
+            sess = requests.Session(); sess.headers.update(HTTP_HEADERS)
+            adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=HOST_LIMITS.get(host, 4))
+            sess.mount("https://", adapter); sess.mount("http://", adapter)
+            _http_sessions[host] = sess
+        return sess
+
+def _http_get(url: str, timeout: float = 10, **kwargs) -> requests.Response:
+    return _http_session(urlparse(url).netloc).get(url, timeout=timeout, **kwargs)
+
+# --- OHLCV Store (증분 일봉 저장소) ---
+
+OHLCV_DB_PATH = os.path.join(STATE_DIR, "ohlcv.db")
+OHLCV_HISTORY_DAYS = 183   # 지표 계산에 쓰는 기간 (기존 period="6mo")
+OHLCV_OVERLAP_DAYS = 4     # 증분 조회 시 마지막 보관일 앞쪽으로 겹쳐 받는 기간 (수정주가 변경 감지용)
+OHLCV_ADJ_TOLERANCE = 1e-4 # 겹친 구간 종가가 이 비율 이상 다르면 수정주가 변경으로 보고 전체 재수집
+_OHLCV_FIELDS = ["Open", "High", "Low", "Close", "Volume"]
+
+def _shift_date(d: str, days: int) -> str:
+    return (datetime.strptime(d, "%Y-%m-%d") + timedelta(days=days)).strftime("%Y-%m-%d")
+
+def _ohlcv_rows(df: pd.DataFrame, tickers: List[str]) -> List[Tuple]:
+    """yf.download 결과를 (ticker, date, open, high, low, close, volume) 행으로 정규화 (종가 없는 행 제외)"""
+    if df.empty: return []
+    if not isinstance(df.columns, pd.MultiIndex): df = pd.concat({tickers[0]: df}, axis=1).swaplevel(axis=1)
+    arr = np.stack([df[f].reindex(columns=tickers).to_numpy(dtype=float) for f in _OHLCV_FIELDS], axis=-1)
+    dates = [d.strftime("%Y-%m-%d") for d in df.index]
+    di, ti = np.nonzero(~np.isnan(arr[:, :, 3]))
+    return [(tickers[t], dates[d], *(None if v != v else float(v) for v in arr[d, t])) for d, t in zip(di, ti)]
+
+class OHLCVStore:
+    """(ticker, date) 단위 일봉 저장소 (SQLite)
+
+    종목별 보관 구간(ohlcv_coverage)을 기억해 빠진 구간(앞쪽 backfill, 마지막 보관일 이후)만
+    multi-ticker 호출로 내려받는다. 마지막 보관일 앞 OHLCV_OVERLAP_DAYS를 겹쳐 받아 종가가
+    달라졌으면(분할·배당 수정주가) 해당 종목 전체를 다시 받는다.
+    """
+    def __init__(self, path: str = OHLCV_DB_PATH):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS ohlcv (
+                ticker TEXT NOT NULL, date TEXT NOT NULL,
+                open REAL, high REAL, low REAL, close REAL, volume INTEGER,
+                PRIMARY KEY (ticker, date)
+            ) WITHOUT ROWID
+        """)
+        self._conn.execute("CREATE TABLE IF NOT EXISTS ohlcv_coverage (ticker TEXT PRIMARY KEY, start TEXT, end TEXT, fetched_at TEXT)")
+        self._conn.commit()
+        self.stats = {"calls": 0, "rows": 0, "refetched": 0}
+
+    def _coverage(self, tickers: List[str]) -> Dict[str, Tuple[str, str]]:
+        rows = self._conn.execute(f"SELECT ticker, start, end FROM ohlcv_coverage WHERE ticker IN ({', '.join('?' * len(tickers))})", tickers)
+        return {t: (s, e) for t, s, e in rows}
+
+    def _download(self, tickers: List[str], start: str, end: str) -> List[Tuple]:
+        # yfinance의 end는 미포함
+        self.stats["calls"] += 1
+        with METRICS.timed("yfinance"):
+            df = yf.download(" ".join(tickers), start=start, end=_shift_date(end, 1), interval="1d", progress=False)
+        rows = _ohlcv_rows(df, tickers)
+        self.stats["rows"] += len(rows)
+        return rows
+
+    def _adjusted(self, rows: List[Tuple], cov: Dict[str, Tuple[str, str]]) -> List[str]:
+        """겹쳐 받은 구간(마지막 보관일 이전)의 종가가 보관값과 다른 종목"""
+        overlap = [r for r in rows if r[0] in cov and cov[r[0]][0] <= r[1] < cov[r[0]][1]]
+        if not overlap: return []
+        stored = {(t, d): c for t, d, c in self._conn.execute(
+            f"SELECT ticker, date, close FROM ohlcv WHERE ticker IN ({', '.join('?' * len({r[0] for r in overlap}))}) AND date >= ?",
+            [*{r[0] for r in overlap}, min(r[1] for r in overlap)])}
+        return sorted({r[0] for r in overlap
+                       if stored.get(r[:2]) and abs(r[5] / stored[r[:2]] - 1) > OHLCV_ADJ_TOLERANCE})
+
+    def _store(self, rows: List[Tuple], tickers: List[str], start: str, end: str, replace: bool = False):
+        # yfinance는 종목별 실패를 예외 대신 빈(NaN) 열로 돌려준다. 행이 하나도 없는 종목은 보관 구간을 넓히지 않아 다음에 다시 받는다
+        fetched = {r[0] for r in rows}
+        tickers = [t for t in tickers if t in fetched]
+        with self._conn:
+            if replace: self._conn.executemany("DELETE FROM ohlcv WHERE ticker = ?", [(t,) for t in tickers])
+            self._conn.executemany("INSERT OR REPLACE INTO ohlcv VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+            # 구간 안에 데이터가 없는 날(휴장일, 상장 전)이 있어도 조회한 구간 전체를 보관 구간으로 기록
+            self._conn.executemany("""
+                INSERT INTO ohlcv_coverage VALUES (?, ?, ?, ?) ON CONFLICT(ticker) DO UPDATE SET
+                    start = CASE WHEN ? THEN excluded.start ELSE MIN(start, excluded.start) END,
+                    end = MAX(end, excluded.end), fetched_at = excluded.fetched_at
+            """, [(t, start, end, datetime.now().isoformat(), replace) for t in tickers])
+
+    def ensure(self, tickers: List[str], start: str, end: Optional[str] = None) -> int:
+        """[start, end] 구간이 보관되도록 빠진 구간만 내려받는다. 반환: 받은 행 수"""
+        if not tickers: return 0
+        end = end or datetime.now().strftime("%Y-%m-%d")
+        with self._lock:
+            cov = self._coverage(tickers)
+            jobs: Dict[Tuple[str, str], List[str]] = {}
+            for t in tickers:
+                s, e = cov.get(t, (None, None))
+                if s is None: jobs.setdefault((start, end), []).append(t); continue
+                if start < s: jobs.setdefault((start, _shift_date(s, -1)), []).append(t)
+                if e < end: jobs.setdefault((max(s, _shift_date(e, -OHLCV_OVERLAP_DAYS)), end), []).append(t)
+            fetched, stale = 0, set()
+            for (a, b), group in jobs.items():
+                try: rows = self._download(group, a, b)
+                except Exception as e: print(f"[Price Error] {e}"); continue
+                stale.update(self._adjusted(rows, cov))
+                self._store(rows, group, a, b); fetched += len(rows)
+            if stale:
+                stale = sorted(stale)
+                full_start = min([start] + [cov[t][0] for t in stale])
+                try:
+                    rows = self._download(stale, full_start, end)
+                    self._store(rows, stale, full_start, end, replace=True); fetched += len(rows)
+                    self.stats["refetched"] += len(stale)
+                except Exception as e: print(f"[Price Error] {e}")
+            return fetched
+
+    def refresh_recent(self, tickers: List[str], days: int = 1) -> int:
+        """최근 days일 봉을 다시 받아 덮어쓴다 (장중에는 당일 봉이 계속 바뀜). 보관 중인 종목만 대상"""
+        end = datetime.now().strftime("%Y-%m-%d"); start = _shift_date(end, -days)
+        with self._lock:
+            tickers = list(self._coverage(tickers)) if tickers else []
+            if not tickers: return 0
+            rows = self._download(tickers, start, end)
+            self._store(rows, tickers, start, end)
+            return len(rows)
+
+    def panel(self, tickers: List[str], start: str, fields: Tuple[str, ...] = ("close", "volume")) -> Dict[str, pd.DataFrame]:
+        """보관된 일봉을 필드별 date×ticker 행렬로 조회"""
+        empty = {f: pd.DataFrame(columns=tickers, dtype=float) for f in fields}
+        if not tickers: return empty
+        with self._lock:
+            rows = pd.read_sql_query(f"SELECT ticker, date, {', '.join(fields)} FROM ohlcv WHERE date >= ? AND ticker IN ({', '.join('?' * len(tickers))})",
+                                     self._conn, params=[start, *tickers])
+        if rows.empty: return empty
+        rows["date"] = pd.to_datetime(rows["date"])
+        return {f: rows.pivot(index="date", columns="ticker", values=f).reindex(columns=tickers).sort_index() for f in fields}
+
+    def load(self, tickers: List[str], start: str, fields: Tuple[str, ...] = ("close", "volume")) -> Dict[str, pd.DataFrame]:
+        self.ensure(tickers, start)
+        return self.panel(tickers, start, fields)
+
+_ohlcv_store: Optional[OHLCVStore] = None
+_ohlcv_store_lock = threading.Lock()
+
+def get_ohlcv_store() -> OHLCVStore:
+    global _ohlcv_store
+    with _ohlcv_store_lock:
+        if _ohlcv_store is None: _ohlcv_store = OHLCVStore()
+        return _ohlcv_store
+
+def compute_technical_panel(close: pd.DataFrame, volume: pd.DataFrame) -> Dict[str, Dict[str, Any]]:
+    """date×ticker 행렬에서 모든 종목의 technical 지표를 한 번에 계산"""
+    if close.empty or len(close) < 6: return {}
+    close = close.ffill()
+    macd = close.ewm(span=12, adjust=False).mean() - close.ewm(span=26, adjust=False).mean()
+    signal = macd.ewm(span=9, adjust=False).mean()
+    m, s = macd.to_numpy(), signal.to_numpy()
+    golden = (m[-1] > s[-1]) & (m[-2] <= s[-2])
+    macd_status = np.where(golden, "Golden Cross", np.where(m[-1] < s[-1], "Bearish", "Neutral"))
+
+    last, prev_week = close.iloc[-1], close.iloc[-6]
+    panel = pd.DataFrame({
+        "price": last,
+        "weekly_return": (((last / prev_week) - 1) * 100).round(2),
+        "macd": macd_status,
+        "vol_spike": (volume.iloc[-1] / volume.rolling(window=20).mean().iloc[-1]).round(2),
+        "is_bullish": close.rolling(window=5).mean().iloc[-1] > close.rolling(window=20).mean().iloc[-1],
+    }, index=close.columns)
+    panel = panel[last.notna() & prev_week.notna()]
+    panel["price"] = panel["price"].astype(np.int64)
+    return panel.to_dict("index")
+
+@taped("technical_panel", by_ticker=True)
+def fetch_technical_panel(tickers: List[str], days: int = OHLCV_HISTORY_DAYS) -> Dict[str, Dict[str, Any]]:
+    """유니버스 전체 일봉을 증분 저장소에서 읽어(빠진 구간만 다운로드) 지표 계산"""
+    if not tickers: return {}
+    bars = get_ohlcv_store().load(tickers, (datetime.now() - timedelta(days=days)).strftime("%Y-%m-%d"))
+    return compute_technical_panel(bars["close"], bars["volume"])
+
+@taped("technical")
+def _fetch_technical(ticker: str) -> Dict[str, Any]:
+    return fetch_technical_panel([ticker]).get(ticker, {})
+
+@taped("naver_fundamental")
+def _fetch_naver_fundamental(code: str) -> Dict[str, Any]:
+    soup_main = BeautifulSoup(_http_get(f"https://finance.naver.com/item/main.naver?code={code}").text, "html.parser")
+    def _p(s, i):
+        try: return float(s.find("em", id=i).text.replace(",","").replace("배","").replace("%",""))
+        except (AttributeError, ValueError): return 0.0
+    
+    return {"per": _p(soup_main, "_per"), "pbr": _p(soup_main, "_pbr"), "roe": _p(soup_main, "_roe"), "target_price": _parse_target_price(soup_main)}
+
+def _parse_target_price(soup) -> str:
+    em = soup.select_one("table.item_info tr td em")
+    return em.text.replace(",", "") if em else "N/A"
+
+@taped("target_price", stub=lambda code: "N/A")
+def _fetch_target_price(code: str) -> str:
+    """네이버 종목 메인의 목표주가 (거래일 스냅샷에는 없는 필드)"""
+    return _parse_target_price(BeautifulSoup(_http_get(f"https://finance.naver.com/item/main.naver?code={code}").text, "html.parser"))
+
+@taped("investor")
+def _fetch_investor(code: str) -> Dict[str, int]:
+    soup_frgn = BeautifulSoup(_http_get(f"https://finance.naver.com/item/frgn.naver?code={code}").text, "html.parser")
+    f_sum, i_sum = 0, 0
+    for row in soup_frgn.select("table.type2 tr")[:15]:
+        cols = row.find_all("td")
+        if len(cols) >= 9:
+            try: f_sum += int(cols[6].text.replace(",","")); i_sum += int(cols[5].text.replace(",",""))
+            except ValueError: continue
+    return {"foreign_net": f_sum, "institution_net": i_sum}
+
+@taped("news")
+def _fetch_news(code: str) -> List[str]:
+    news_res = _http_get(f"https://m.stock.naver.com/api/news/stock/{code}?pageSize=5&page=1").json()
+    return [f"[{i.get('title','')}] {i.get('body','')}".replace('&quot;','"') for e in news_res if 'items' in e for i in e['items']]
+
+@taped("ticker_name")
+def get_ticker_name(code: str) -> str:
+    return stock.get_market_ticker_name(code)
+
+@taped("dart")
+def get_dart_summary(corp_name: str) -> Dict[str, Any]:
+    return get_dart_collector().get_summary(corp_name)
+
+def _assemble_raw(ticker, name, technical, fundamental, db_fundamental, dart, investor, news) -> Dict[str, Any]:
+    # PostgreSQL에서 추가 재무 데이터 병합
+    if db_fundamental:
+        fundamental.update(db_fundamental)
+    return {"ticker": ticker, "name": name, "technical": technical, "fundamental": fundamental, "dart": dart, "investor": investor, "news": news}
 
 def collect_stock_data(ticker: str) -> Dict[str, Any]:
-    code = ticker.split(".")[0]; name = stock.get_market_ticker_name(code)
-    dart_collector = DartFinancialCollector(DART_API_KEY)
+    """단일 종목 순차 수집 (디버깅용, 파이프라인은 collect_universe 사용)"""
+    code = ticker.split(".")[0]; name = get_ticker_name(code)
     try:
-        df = yf.download(ticker, period="6mo", interval="1d", progress=False)
-        if df.empty: return {}
-        def safe_get(series, idx=-1):
-            val = series.iloc[idx]; return float(val.iloc[0]) if hasattr(val, 'iloc') else float(val)
-        
-        last_close = safe_get(df['Close'])
-        exp1 = df['Close'].ewm(span=12, adjust=False).mean(); exp2 = df['Close'].ewm(span=26, adjust=False).mean()
-        macd = exp1 - exp2; signal = macd.ewm(span=9, adjust=False).mean()
-        macd_status = "Golden Cross" if safe_get(macd) > safe_get(signal) and macd.iloc[-2] <= signal.iloc[-2] else "Bearish" if safe_get(macd) < safe_get(signal) else "Neutral"
-        vol_spike = round(float(df['Volume'].iloc[-1] / df['Volume'].rolling(window=20).mean().iloc[-1]), 2)
-        
-        technical = {"price": int(last_close), "weekly_return": round(((last_close / safe_get(df['Close'], -6)) - 1) * 100, 2), "macd": macd_status, "vol_spike": vol_spike, "is_bullish": safe_get(df['Close'].rolling(window=5).mean()) > safe_get(df['Close'].rolling(window=20).mean())}
-        
-        soup_main = BeautifulSoup(requests.get(f"https://finance.naver.com/item/main.naver?code={code}", headers={"User-Agent":"Mozilla/5.0"}).text, "html.parser")
-        def _p(s, i):
-            try: return float(s.find("em", id=i).text.replace(",","").replace("배","").replace("%",""))
-            except: return 0.0
-        
-        fundamental = {"per": _p(soup_main, "_per"), "pbr": _p(soup_main, "_pbr"), "roe": _p(soup_main, "_roe"), "target_price": soup_main.select_one("table.item_info tr td em").text.replace(",", "") if soup_main.select_one("table.item_info tr td em") else "N/A"}
-        
-        # PostgreSQL에서 추가 재무 데이터 병합
-        db_fundamental = get_fundamental_from_db(ticker)
-        if db_fundamental:
-            fundamental.update(db_fundamental)
-        
-        dart = dart_collector.get_summary(name)
-        soup_frgn = BeautifulSoup(requests.get(f"https://finance.naver.com/item/frgn.naver?code={code}", headers={"User-Agent":"Mozilla/5.0"}).text, "html.parser")
-        f_sum, i_sum = 0, 0
-        for row in soup_frgn.select("table.type2 tr")[:15]:
-            cols = row.find_all("td")
-            if len(cols) >= 9:
-                try: f_sum += int(cols[6].text.replace(",","")); i_sum += int(cols[5].text.replace(",",""))
-                except: continue
-        
-        news_res = requests.get(f"https://m.stock.naver.com/api/news/stock/{code}?pageSize=5&page=1", headers={"User-Agent":"Mozilla/5.0"}).json()
-        news = [f"[{i.get('title','')}] {i.get('body','')}".replace('&quot;','"') for e in news_res if 'items' in e for i in e['items']]
-        
-        return {"ticker": ticker, "name": name, "technical": technical, "fundamental": fundamental, "dart": dart, "investor": {"foreign_net": f_sum, "institution_net": i_sum}, "news": news}
-    except: return {}
+        technical = _fetch_technical(ticker)
+        if not technical: return {}
+        return _assemble_raw(ticker, name, technical, _fetch_naver_fundamental(code), get_fundamental_from_db(ticker),
+                             get_dart_summary(name), _fetch_investor(code), _fetch_news(code))
+    except Exception:
+        METRICS.incr("failures", "collect"); return {}
+
+# --- 1-0. Market Snapshot (시장 전체 벌크 조회) ---
+
+MARKET_SNAPSHOT_PATH = os.path.join(STATE_DIR, "market_snapshot.json")
+MARKET_SUFFIX = {"KOSDAQ": "KQ", "KOSPI": "KS"}
+INVESTOR_FLOW_DAYS = 14  # 네이버 frgn 페이지 상단 15행(약 10거래일)에 해당하는 기간
+TARGET_PRICE_PATH = os.path.join(STATE_DIR, "target_prices.json")
+SNAPSHOT_TARGET_PRICE = os.getenv("SNAPSHOT_TARGET_PRICE", "0").strip() == "1"  # 1이면 스냅샷 종목의 목표주가를 거래일당 한 번 스크래핑 (기본 N/A)
+
+@taped("market_snapshot")
+def fetch_market_snapshot(asof: str, market: str) -> Dict[str, Dict[str, Dict]]:
+    """pykrx 벌크 호출로 시장 전체 PER/PBR/ROE와 외국인·기관 순매수량 조회 (종목코드 키)"""
+    with METRICS.timed("krx"): fund = stock.get_market_fundamental_by_ticker(asof, market=market)
+    roe = (fund['EPS'] / fund['BPS'].where(fund['BPS'] > 0) * 100).round(2).fillna(0.0)
+    fundamental = {code: {"per": float(per), "pbr": float(pbr), "roe": float(r), "target_price": "N/A"}
+                   for code, per, pbr, r in zip(fund.index, fund['PER'], fund['PBR'], roe)}
+    investor = {}
+    try:
+        start = (datetime.strptime(asof, "%Y%m%d") - timedelta(days=INVESTOR_FLOW_DAYS)).strftime("%Y%m%d")
+        with METRICS.timed("krx"): frgn = stock.get_market_net_purchases_of_equities_by_ticker(start, asof, market, "외국인")['순매수거래량']
+        with METRICS.timed("krx"): inst = stock.get_market_net_purchases_of_equities_by_ticker(start, asof, market, "기관합계")['순매수거래량']
+        investor = {code: {"foreign_net": int(frgn.get(code, 0)), "institution_net": int(inst.get(code, 0))}
+                    for code in frgn.index.union(inst.index)}
+    except Exception as e: print(f"[Snapshot] investor flow unavailable ({market}): {e}")
+    return {"fundamental": fundamental, "investor": investor}
+
+def load_market_snapshot(markets: List[str], asof: Optional[str] = None) -> Dict[str, Dict[str, Dict]]:
+    """거래일당 한 번만 조회해 파일로 캐시. 반환: {"fundamental": {ticker: ...}, "investor": {ticker: ...}}"""
+    asof = asof or get_latest_trading_day()
+    replay = TAPE is not None and TAPE.mode == "replay"  # 재생 시에는 파일 캐시를 읽지도 쓰지도 않는다
+    cache = {}
+    if not replay and os.path.exists(MARKET_SNAPSHOT_PATH):
+        try: cache = json.load(open(MARKET_SNAPSHOT_PATH, encoding="utf-8"))
+        except Exception: METRICS.incr("failures", "market_snapshot_cache")
+    if cache.get("asof") != asof: cache = {"asof": asof, "markets": {}}
+    dirty, out = False, {"fundamental": {}, "investor": {}}
+    for market in markets:
+        if market not in cache["markets"]:
+            try: cache["markets"][market] = fetch_market_snapshot(asof, market); dirty = True
+            except Exception as e: print(f"[Snapshot Error] {market}: {e}"); continue
+        suffix = MARKET_SUFFIX[market]
+        for kind in out:
+            out[kind].update({f"{code}.{suffix}": v for code, v in cache["markets"][market][kind].items()})
+    if dirty and not replay: json.dump(cache, open(MARKET_SNAPSHOT_PATH, "w", encoding="utf-8"), ensure_ascii=False)
+    return out
+
+def load_target_prices(asof: str) -> Dict[str, str]:
+    """거래일 단위로 캐시한 목표주가 {ticker: price}. 다른 거래일이면 빈 dict"""
+    if TAPE is not None and TAPE.mode == "replay" or not os.path.exists(TARGET_PRICE_PATH): return {}
+    try: cache = json.load(open(TARGET_PRICE_PATH, encoding="utf-8"))
+    except Exception: METRICS.incr("failures", "target_price_cache"); return {}
+    return cache.get("prices", {}) if cache.get("asof") == asof else {}
+
+def save_target_prices(asof: str, prices: Dict[str, str]):
+    if TAPE is not None and TAPE.mode == "replay": return
+    json.dump({"asof": asof, "prices": prices}, open(TARGET_PRICE_PATH, "w", encoding="utf-8"), ensure_ascii=False)
+
+# --- 1-1. Async Collection Engine ---
+
+class HostLimiter:
+    """호스트별 동시성 제한. 블로킹 호출은 전용 스레드 풀에서 실행"""
+    def __init__(self, limits: Optional[Dict[str, int]] = None):
+        self.limits = dict(HOST_LIMITS, **(limits or {}))
+        self._sems: Dict[str, asyncio.Semaphore] = {}
+        self._pool = ThreadPoolExecutor(max_workers=sum(self.limits.values()), thread_name_prefix="collect")
+
+    async def run(self, host: str, fn, *args):
+        sem = self._sems.get(host)
+        if sem is None:
+            sem = self._sems[host] = asyncio.Semaphore(self.limits.get(host, 4))
+        async with sem:
+            t0 = time.perf_counter()
+            try:
+                return await asyncio.get_running_loop().run_in_executor(self._pool, fn, *args)
+            except Exception:
+                METRICS.incr("failures", host); raise
+            finally:
+                METRICS.observe_host(host, time.perf_counter() - t0)
+
+    def close(self):
+        self._pool.shutdown(wait=False)
+
+async def _prefetched(value):
+    return value
+
+async def collect_stock_data_async(ticker: str, limiter: HostLimiter, prefetch: Optional[Dict[str, Dict]] = None) -> Dict[str, Any]:
+    """종목 하나의 독립 소스들을 동시에 요청. 결과는 collect_stock_data와 동일한 raw dict
+
+    prefetch: 유니버스 단위로 미리 받아둔 소스 ({"technical": {ticker: {...}}, ...}). 있으면 개별 요청 생략.
+    """
+    code = ticker.split(".")[0]
+    prefetch = prefetch or {}
+
+    def _source(key, host, fn, *args, fallback=True):
+        # 선수집 결과가 있으면 사용. fallback=False면 선수집에서 빠진 종목은 빈 값으로 간주
+        if key in prefetch and (ticker in prefetch[key] or not fallback):
+            value = prefetch[key].get(ticker, {})
+            return _prefetched(dict(value) if isinstance(value, dict) else value)
+        return limiter.run(host, fn, *args)
+    name_task = asyncio.ensure_future(limiter.run("krx", get_ticker_name, code))
+
+    async def _dart():
+        name = await name_task
+        return await limiter.run("opendart.fss.or.kr", get_dart_summary, name)
+
+    async def _fundamental():
+        # 스냅샷(pykrx)에는 목표주가가 없어 목표주가만 따로 받는다
+        fund = await _source("fundamental", "finance.naver.com", _fetch_naver_fundamental, code)
+        cached = prefetch.get("target_price")
+        if cached is not None and fund.get("target_price") == "N/A" and ticker in prefetch.get("fundamental", {}):
+            if ticker not in cached:
+                try: cached[ticker] = await limiter.run("finance.naver.com", _fetch_target_price, code)
+                except Exception: return fund  # 실패는 HostLimiter가 집계, 목표주가 없이 진행
+            fund["target_price"] = cached[ticker]
+        return fund
+
+    results = await asyncio.gather(
+        _source("technical", "yfinance", _fetch_technical, ticker),
+        _fundamental(),
+        _source("db_fundamental", "postgres", get_fundamental_from_db, ticker, fallback=False),
+        _dart(),
+        _source("investor", "finance.naver.com", _fetch_investor, code),
+        limiter.run("m.stock.naver.com", _fetch_news, code),
+        name_task,
+        return_exceptions=True,
+    )
+    if any(isinstance(r, BaseException) for r in results):
+        METRICS.incr("failures", "collect"); return {}
+    technical, fundamental, db_fundamental, dart, investor, news, name = results
+    if not technical: return {}
+    return _assemble_raw(ticker, name, technical, fundamental, db_fundamental, dart, investor, news)
+
+async def collect_universe_async(universe: List[str], limiter: Optional[HostLimiter] = None, on_result=None,
+                                 prefetch: Optional[Dict[str, Dict]] = None) -> List[Dict[str, Any]]:
+    own_limiter = limiter is None
+    limiter = limiter or HostLimiter()
+    collected = []
+    try:
+        for fut in asyncio.as_completed([collect_stock_data_async(t, limiter, prefetch) for t in universe]):
+            raw = await fut
+            if not raw: continue
+            collected.append(raw)
+            if on_result:
+                res = on_result(raw)
+                if asyncio.iscoroutine(res): await res
+    finally:
+        if own_limiter: limiter.close()
+    return collected
+
+def collect_universe(universe: List[str], on_result=None, panel: bool = True) -> List[Dict[str, Any]]:
+    """유니버스 전체를 비동기로 수집 (Step 1 소요시간 ≈ 가장 느린 소스)
+
+    panel=True면 technical 지표를 multi-ticker 다운로드 + 행렬 연산으로 일괄 계산.
+    fundamental/investor는 거래일 스냅샷에서 제공하고, 빠진 종목만 네이버 HTML을 스크래핑.
+    SNAPSHOT_TARGET_PRICE면 스냅샷에 없는 목표주가를 거래일당 한 번만 스크래핑해 캐시한다.
+    """
+    prefetch = {}
+    suffix_market = {v: k for k, v in MARKET_SUFFIX.items()}
+    markets = sorted({suffix_market[t.split(".")[1]] for t in universe if t.split(".")[-1] in suffix_market})
+    asof = get_latest_trading_day()
+    prefetch.update(load_market_snapshot(markets, asof))
+    if SNAPSHOT_TARGET_PRICE: prefetch["target_price"] = load_target_prices(asof)
+    if panel:
+        try: prefetch["technical"] = fetch_technical_panel(universe)
+        except Exception as e: print(f"[Panel Error] {e}")  # 종목별 다운로드로 폴백
+    try: prefetch["db_fundamental"] = get_fundamentals_bulk(universe)
+    except Exception as e: print(f"[DB Error] bulk: {e}")  # 종목별 조회로 폴백
+    collected = asyncio.run(collect_universe_async(universe, on_result=on_result, prefetch=prefetch))
+    if SNAPSHOT_TARGET_PRICE: save_target_prices(asof, prefetch["target_price"])
+    return collected
+
+# --- 1-2. News Store (기사 중복 제거 + 요약 캐시) ---
+
+NEWS_DB_PATH = os.path.join(STATE_DIR, "news.db")
+NEWS_SIMHASH_DISTANCE = 6  # 64비트 simhash 해밍 거리가 이 이하면 같은 기사로 본다
+NEWS_SUMMARY_BATCH = 20    # 요약 요청 1회당 기사 수
+NEWS_SNIPPET_CHARS = 200
+
+def _normalize_article(text: str) -> str:
+    return re.sub(r"\s+", " ", text).strip().rstrip(".… ")
+
+def article_id(text: str) -> str:
+    """기사 내용 해시 (공백·말줄임 차이는 무시)"""
+    return hashlib.sha1(_normalize_article(text).encode("utf-8")).hexdigest()[:16]
+
+def simhash(text: str) -> int:
+    """단어 bigram 기반 64비트 simhash"""
+    words = re.findall(r"\w+", text.lower())
+    v = [0] * 64
+    for gram in set(zip(words, words[1:])) or {(w,) for w in words}:
+        h = int.from_bytes(hashlib.blake2b(" ".join(gram).encode("utf-8"), digest_size=8).digest(), "big")
+        for i in range(64): v[i] += 1 if h >> i & 1 else -1
+    return sum(1 << i for i in range(64) if v[i] > 0)
+
+def _simhash_bands(h: int) -> List[int]:
+    # 해밍 거리 7 이하인 두 값은 8비트 구간 8개 중 적어도 하나가 같다
+    return [h >> (8 * i) & 0xFF for i in range(8)]
+
+class NewsStore:
+    """종목 뉴스 기사 저장소 (SQLite)
+
+    기사는 내용 해시로 식별하고, 다른 종목에 붙은 유사 중복(simhash)은 하나의 대표 기사로 묶는다.
+    요약은 대표 기사 단위로 한 번만 만들어 재사용하며, 종목별 프롬프트에는 기사 참조만 싣는다.
+    """
+    def __init__(self, path: str = NEWS_DB_PATH):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.stats = {"new": 0, "duplicates": 0, "near_duplicates": 0, "summarized": 0, "summary_hits": 0}
+        self._lock = threading.Lock()
+        self._inflight: Dict[str, threading.Event] = {}
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS articles (
+                article_id TEXT PRIMARY KEY, canonical_id TEXT NOT NULL, simhash TEXT,
+                b0 INTEGER, b1 INTEGER, b2 INTEGER, b3 INTEGER, b4 INTEGER, b5 INTEGER, b6 INTEGER, b7 INTEGER,
+                text TEXT, first_seen TEXT, summary TEXT, summary_model TEXT
+            )
+        """)
+        for i in range(8): self._conn.execute(f"CREATE INDEX IF NOT EXISTS idx_articles_b{i} ON articles (b{i})")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS article_refs (
+                canonical_id TEXT NOT NULL, ticker TEXT NOT NULL, last_seen TEXT,
+                PRIMARY KEY (canonical_id, ticker)
+            )
+        """)
+        self._conn.commit()
+
+    def _near_duplicate(self, h: int) -> Optional[str]:
+        where = " OR ".join(f"b{i} = ?" for i in range(8))
+        rows = self._conn.execute(f"SELECT canonical_id, simhash FROM articles WHERE {where}", _simhash_bands(h))
+        return next((cid for cid, sh in rows if bin(int(sh, 16) ^ h).count("1") <= NEWS_SIMHASH_DISTANCE), None)
+
+    def ingest(self, ticker: str, texts: List[str]) -> List[str]:
+        """종목 뉴스를 등록하고 대표 기사 id 목록을 반환 (수집 순서 유지, 중복 제거)"""
+        ids, now = [], datetime.now().isoformat()
+        with self._lock, self._conn:
+            for text in texts or []:
+                if not isinstance(text, str) or not text.strip(): continue
+                aid = article_id(text)
+                row = self._conn.execute("SELECT canonical_id FROM articles WHERE article_id = ?", (aid,)).fetchone()
+                if row: cid = row[0]; self.stats["duplicates"] += 1
+                else:
+                    h = simhash(text)
+                    cid = self._near_duplicate(h)
+                    self.stats["near_duplicates" if cid else "new"] += 1
+                    # 샤드 프로세스가 같은 기사를 동시에 넣을 수 있으므로 먼저 들어간 행을 대표로 사용
+                    self._conn.execute("INSERT OR IGNORE INTO articles (article_id, canonical_id, simhash, b0, b1, b2, b3, b4, b5, b6, b7, text, first_seen) "
+                                       "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                                       (aid, cid or aid, f"{h:016x}", *_simhash_bands(h), text, now))
+                    cid = self._conn.execute("SELECT canonical_id FROM articles WHERE article_id = ?", (aid,)).fetchone()[0]
+                self._conn.execute("INSERT INTO article_refs VALUES (?, ?, ?) ON CONFLICT(canonical_id, ticker) DO UPDATE SET last_seen = excluded.last_seen",
+                                   (cid, ticker, now))
+                if cid not in ids: ids.append(cid)
+        return ids
+
+    def articles(self, ids: List[str]) -> Dict[str, Dict[str, Any]]:
+        """대표 기사 {id: {text, summary, summary_model, tickers(참조 종목 수)}}"""
+        if not ids: return {}
+        with self._lock:
+            rows = self._conn.execute(f"""
+                SELECT a.article_id, a.text, a.summary, a.summary_model,
+                       (SELECT COUNT(*) FROM article_refs r WHERE r.canonical_id = a.article_id)
+                FROM articles a WHERE a.article_id IN ({', '.join('?' * len(ids))})
+            """, list(ids)).fetchall()
+        return {r[0]: {"text": r[1], "summary": r[2], "summary_model": r[3], "tickers": r[4]} for r in rows}
+
+    def snippet(self, article: Dict[str, Any]) -> str:
+        return article["summary"] or _normalize_article(article["text"])[:NEWS_SNIPPET_CHARS]
+
+    def summarize(self, ids: List[str], model: str = None) -> Dict[str, str]:
+        """대표 기사 한 줄 요약. 캐시에 없는 기사만 NEWS_SUMMARY_BATCH개씩 묶어 요청
+
+        다른 스레드가 같은 기사를 요약 중이면 끝날 때까지 기다렸다가 그 결과를 쓴다.
+        요약에 실패한 기사는 원문 앞부분을 돌려주고 캐시하지 않는다.
+        """
+        model = model or LITE_MODEL
+        arts = self.articles(ids)
+        out = {i: a["summary"] for i, a in arts.items() if a["summary"] and a["summary_model"] == model}
+        self.stats["summary_hits"] += len(out)
+        missing = [i for i in dict.fromkeys(ids) if i in arts and i not in out]
+        with self._lock:
+            mine = [i for i in missing if i not in self._inflight]
+            for i in mine: self._inflight[i] = threading.Event()
+            waits = {i: self._inflight[i] for i in missing if i not in mine}
+        try:
+            for chunk in [mine[k:k + NEWS_SUMMARY_BATCH] for k in range(0, len(mine), NEWS_SUMMARY_BATCH)]:
+                body = "\n".join(f"[{i}] {_normalize_article(arts[i]['text'])[:600]}" for i in chunk)
+                p = (f"Summarize each news article below in one sentence, keeping company names and figures.\n\n{body}\n\n"
+                     f"Return ONLY JSON mapping article id to summary, e.g. {{\"{chunk[0]}\": \"...\"}}.")
+                try: res = _llm_chat([{"role": "user", "content": p}], model=model, parse=_extract_json)
+                except Exception: res = {}
+                got = {i: str(res[i]).strip() for i in chunk if isinstance(res, dict) and res.get(i)}
+                with self._lock, self._conn:
+                    self._conn.executemany("UPDATE articles SET summary = ?, summary_model = ? WHERE article_id = ?",
+                                           [(s, model, i) for i, s in got.items()])
+                self.stats["summarized"] += len(got)
+                out.update(got)
+        finally:
+            with self._lock:
+                for i in mine: self._inflight.pop(i).set()
+        for ev in waits.values(): ev.wait()
+        if waits:
+            out.update({i: a["summary"] for i, a in self.articles(list(waits)).items() if a["summary"]})
+        return {i: out.get(i) or self.snippet(arts[i]) for i in dict.fromkeys(ids) if i in arts}
+
+_news_store: Optional[NewsStore] = None
+_news_store_lock = threading.Lock()
+
+def get_news_store() -> NewsStore:
+    global _news_store
+    with _news_store_lock:
+        if _news_store is None: _news_store = NewsStore(NEWS_DB_PATH)
+        return _news_store
 
 # --- 2. Multi-Agent Logic (Reading from SQLite) ---
 
 def news_agent(raw: Dict) -> str:
-    p = f"You are a financial news analysis agent. Task: Summarize news for {raw['name']}.\nContent: {' '.join(raw['news'])}\nProvide a concise summary."
-    return _llm_chat([{"role": "user", "content": p}], model=LITE_MODEL)
+    """종목 뉴스를 기사별 요약 목록으로 정리. 요약은 대표 기사 단위로 캐시되어 종목 간에 공유된다"""
+    store = get_news_store()
+    ids = store.ingest(raw['ticker'], raw.get('news', []))
+    summaries = store.summarize(ids)
+    return "\n".join(f"[{i}] {summaries[i]}" for i in ids if i in summaries) or "No recent news."
 
 def technical_agent(raw: Dict) -> str:
     p = f"You are a stock price analysis agent. Task: Analyze technicals for {raw['name']}.\nData: {raw['technical']}\nProvide analysis summary."
@@ -317,146 +1765,1101 @@ Provide a concise summary focusing on:
 def score_agent(raw: Dict, n_summ: str, f_summ: str, t_anal: str) -> Dict[str, Any]:
     p = f"Expert evaluator. Stock: {raw['name']}\nNews: {n_summ}\nFund: {f_summ}\nTech: {t_anal}\nScore 6 dimensions (1-10): financial_health, growth_potential, news_sentiment, news_impact, price_momentum, volatility_risk.\nReturn ONLY JSON."
     try:
-        res = _extract_json(_llm_chat([{"role": "user", "content": p}], model=LITE_MODEL))
-        res['scores'] = _normalize_scores(res.get('scores', {}))
-        return res
-    except: return {"scores": {d: 5 for d in SCORING_DIMENSIONS}}
+        res = _llm_chat([{"role": "user", "content": p}], model=LITE_MODEL, parse=_extract_json)
+        # LLM 비활성·API 키 없음({})이거나 점수가 없는 응답은 기본 점수로 (지문 없이 저장되어 다음 실행에서 재채점)
+        raw_s = res.get('scores', res) if isinstance(res, dict) else None
+        if not _has_scores(raw_s): raise ValueError("no scores in response")
+        return dict(res, scores=_normalize_scores(raw_s))
+    except Exception:
+        METRICS.incr("failures", "score_agent"); return {"scores": fallback_scores()}
+
+def _stock_brief(raw: Dict, news_refs: List[str]) -> str:
+    """배치 채점용 종목 요약. 뉴스는 배치 상단 기사 목록의 참조로만 싣는다"""
+    return (f"### {raw['ticker']} {raw['name']}\nTech: {raw.get('technical', {})}\nFund: {raw.get('fundamental', {})}\n"
+            f"DART: {raw.get('dart', {})}\nInvestor: {raw.get('investor', {})}\nNews: {' '.join(f'[{i}]' for i in news_refs) or '-'}")
+
+def _score_batch(raws: List[Dict], max_news: int = 3) -> Dict[str, Dict[str, int]]:
+    """여러 종목을 한 번의 요청으로 채점. 파싱된 종목만 반환
+
+    여러 종목에 붙은 같은 기사는 배치 상단에 한 번만 싣는다 (캐시된 요약이 있으면 요약으로).
+    """
+    store = get_news_store()
+    refs = {r['ticker']: store.ingest(r['ticker'], r.get('news', []))[:max_news] for r in raws}
+    arts = store.articles(list(dict.fromkeys(i for ids in refs.values() for i in ids)))
+    news = "\n".join(f"[{i}] {store.snippet(a)}" for i, a in arts.items())
+    briefs = "\n\n".join(_stock_brief(r, [i for i in refs[r['ticker']] if i in arts]) for r in raws)
+    p = (f"Expert evaluator. Score each stock below on 6 dimensions (1-10): {', '.join(SCORING_DIMENSIONS)}.\n\n"
+         f"News articles (referenced by id):\n{news or '-'}\n\n{briefs}\n\n"
+         f"Return ONLY JSON keyed by ticker, e.g. {{\"{raws[0]['ticker']}\": {{\"financial_health\": 7, ...}}, ...}}.")
+    try: res = _llm_chat([{"role": "user", "content": p}], model=LITE_MODEL, parse=_extract_json)
+    except Exception:
+        METRICS.incr("failures", "score_batch"); return {}
+    if isinstance(res, list):
+        res = {str(r.get('ticker', r.get('stock_code', ''))): r for r in res if isinstance(r, dict)}
+    if not isinstance(res, dict): return {}
+    scores = {}
+    for raw in raws:
+        t = raw['ticker']
+        entry = res.get(t, res.get(t.split(".")[0]))
+        entry = entry.get('scores', entry) if isinstance(entry, dict) else None
+        if _has_scores(entry): scores[t] = _normalize_scores(entry)
+    return scores
+
+def batch_score_agent(raws: List[Dict]) -> Dict[str, Dict[str, int]]:
+    """N개 종목 배치 채점. 응답에서 빠졌거나 파싱에 실패한 종목은 단독으로 재시도"""
+    scores = _score_batch(raws)
+    for raw in raws:
+        if raw['ticker'] in scores: continue
+        if len(raws) > 1: METRICS.incr("retries", "batch_score")
+        retry = _score_batch([raw]) if len(raws) > 1 else {}
+        if raw['ticker'] not in retry: METRICS.incr("failures", "batch_score")
+        scores[raw['ticker']] = retry.get(raw['ticker']) or fallback_scores()
+    return scores
+
+SCORE_BATCH_SIZE = int(os.getenv("SCORE_BATCH_SIZE", 0))  # 0이면 종목당 4-agent 모드
+SCORE_WORKERS = int(os.getenv("SCORE_WORKERS", 5))
+
+def analyze_stock(raw: Dict) -> Dict[str, int]:
+    n, te, f = news_agent(raw), technical_agent(raw), fundamental_agent(raw)
+    return score_agent(raw, n, f, te)['scores']
+
+def score_universe(raws: List[Dict], batch_size: int = SCORE_BATCH_SIZE, on_scored=None) -> Dict[str, Dict[str, int]]:
+    """전 종목 채점. batch_size > 0이면 batch_score_agent로 N개씩 묶어 호출"""
+    if batch_size > 0:
+        jobs = [raws[i:i + batch_size] for i in range(0, len(raws), batch_size)]
+        run = batch_score_agent
+    else:
+        jobs, run = [[r] for r in raws], lambda chunk: {chunk[0]['ticker']: analyze_stock(chunk[0])}
+    scores = {}
+    with ThreadPoolExecutor(max_workers=SCORE_WORKERS) as ex:
+        for fut in as_completed([ex.submit(run, chunk) for chunk in jobs]):
+            for t, sc in fut.result().items():
+                scores[t] = sc
+                if on_scored: on_scored(t, sc)
+    return scores
 
 # --- Common Logic ---
 
+_SCORE_SYNONYMS = {"financial_health": ["financial_health", "financial", "profitability", "valuation"], "growth_potential": ["growth_potential", "growth", "potential"], "news_sentiment": ["news_sentiment", "sentiment", "market_sentiment"], "news_impact": ["news_impact", "impact", "influence"], "price_momentum": ["price_momentum", "momentum", "technical"], "volatility_risk": ["volatility_risk", "volatility", "risk", "stability"]}
+
+def _has_scores(raw_s: Any) -> bool:
+    return isinstance(raw_s, dict) and any(s in raw_s for syns in _SCORE_SYNONYMS.values() for s in syns)
+
 def _normalize_scores(raw_s: Dict) -> Dict[str, int]:
     norm = {d: 5 for d in SCORING_DIMENSIONS}
-    m = {"financial_health": ["financial_health", "financial", "profitability", "valuation"], "growth_potential": ["growth_potential", "growth", "potential"], "news_sentiment": ["news_sentiment", "sentiment", "market_sentiment"], "news_impact": ["news_impact", "impact", "influence"], "price_momentum": ["price_momentum", "momentum", "technical"], "volatility_risk": ["volatility_risk", "volatility", "risk", "stability"]}
-    for k, syns in m.items():
+    for k, syns in _SCORE_SYNONYMS.items():
         for s in syns:
             if s in raw_s:
                 try: norm[k] = int(raw_s[s]); break
-                except: pass
+                except (TypeError, ValueError): pass
     return norm
 
-def strategy_agent(traj, overview):
-    p = f"Strategic Advisor. History: {traj}\nMarket: {overview}\nTask: Define strategy. Return concise professional text."
+# --- Trajectory Digest (strategy_agent 입력 요약) ---
+
+DIGEST_STATE_PATH = os.path.join(STATE_DIR, "trajectory_digest.json")
+DIGEST_TOKEN_BUDGET = int(os.getenv("DIGEST_TOKEN_BUDGET", 600))
+DIGEST_THEME_CHARS = 100
+_tokenizer = None
+
+def count_tokens(text: str) -> int:
+    """tiktoken(cl100k_base)이 있으면 그것으로, 없으면 근사치 (한글 1자≈1토큰, 그 외 4자≈1토큰)"""
+    global _tokenizer
+    if _tokenizer is None:
+        try: _tokenizer = importlib.import_module("tiktoken").get_encoding("cl100k_base")
+        except Exception: _tokenizer = False
+    if _tokenizer: return len(_tokenizer.encode(text))
+    hangul = len(re.findall(r"[가-힣]", text))
+    return hangul + (len(text) - hangul + 3) // 4
+
+def strategy_theme(text: str, limit: int = DIGEST_THEME_CHARS) -> str:
+    """전략 문단의 첫 문장 (마크다운 기호 제거, limit자 이내)"""
+    for sentence in re.split(r"(?<=[.!?])\s+|\n+", re.sub(r"[#*_`>]+", "", text or "")):
+        sentence = sentence.strip(" -:")
+        if len(sentence) >= 10: return sentence if len(sentence) <= limit else sentence[:limit - 1] + "…"
+    return "-"
+
+class TrajectoryDigest:
+    """trajectory를 하루 한 줄(성과, 전략 테마, 보유 변화)로 요약해 토큰 예산 안에서 렌더링
+
+    줄과 토큰 수는 일자별로 보관하고 입력(perf, 전략, 보유 종목)이 바뀐 날만 다시 만든다.
+    """
+    def __init__(self, path: str = DIGEST_STATE_PATH):
+        self.path = path
+        self.state: Dict[str, Any] = {"days": {}}
+        if os.path.exists(path):
+            try: self.state.update(json.load(open(path)))
+            except Exception: METRICS.incr("failures", "state_file")
+
+    @staticmethod
+    def _holdings(entry: Dict) -> List[str]:
+        return sorted({_normalize_code(s.get("stock_code")) or str(s.get("stock_code")) for s in entry.get("selected", []) if isinstance(s, dict)})
+
+    def update(self, trajectory: List[Dict]) -> int:
+        """trajectory 반영. 반환: 다시 만든 줄 수"""
+        days, prev, rebuilt = self.state["days"], [], 0
+        for e in sorted(trajectory, key=lambda x: x.get("date", "")):
+            held = self._holdings(e)
+            perf = float(e.get("perf") or 0.0)
+            key = hashlib.sha1(json.dumps([perf, e.get("strategy", ""), held, prev], ensure_ascii=False).encode("utf-8")).hexdigest()
+            if days.get(e["date"], {}).get("key") != key:
+                delta = " ".join([f"+{t}" for t in held if t not in prev] + [f"-{t}" for t in prev if t not in held]) or "no change"
+                line = f"{e['date']} | perf {perf:+.2f}% | {strategy_theme(e.get('strategy', ''))} | {delta}"
+                days[e["date"]] = {"key": key, "perf": perf, "line": line, "tokens": count_tokens(line)}
+                rebuilt += 1
+            prev = held
+        for d in set(days) - {e["date"] for e in trajectory}: del days[d]
+        self.save()
+        return rebuilt
+
+    def render(self, budget: int = DIGEST_TOKEN_BUDGET) -> str:
+        """요약 통계 + 최신 일자부터 예산이 허락하는 만큼의 일자별 줄 (시간순). 헤더와 생략 줄까지 budget 토큰 이내"""
+        days = [self.state["days"][d] for d in sorted(self.state["days"])]
+        if not days: return "No history."
+        perfs = [d["perf"] for d in days]
+        header = (f"{len(days)} days, avg perf {sum(perfs) / len(perfs):+.2f}%, hit rate {sum(p > 0 for p in perfs) / len(perfs):.0%}, "
+                  f"best {max(perfs):+.2f}%, worst {min(perfs):+.2f}%")
+
+        def _text(k: int) -> str:
+            # 최신 k일만 싣고 나머지는 생략 줄로
+            omitted = days[:len(days) - k]
+            note = [f"({len(omitted)} earlier days omitted, avg perf {sum(d['perf'] for d in omitted) / len(omitted):+.2f}%)"] if omitted else []
+            return "\n".join([header] + note + [d["line"] for d in days[len(days) - k:]] if k else [header] + note)
+
+        # 보관된 줄 토큰 수(+줄바꿈)로 k를 잡되 생략 줄 몫을 미리 남겨 두고, 실제 렌더링 토큰 수로 확정
+        used, k = count_tokens(_text(0)) + 1, 0
+        for d in reversed(days):
+            if used + d["tokens"] + 1 > budget: break
+            used += d["tokens"] + 1; k += 1
+        text = _text(k)
+        while k and count_tokens(text) > budget: k -= 1; text = _text(k)
+        # 헤더만으로도 예산을 넘으면 뒤에서부터 단어를 잘라낸다
+        while count_tokens(text) > budget and " " in text: text = text.rsplit(" ", 1)[0]
+        return text
+
+    def save(self):
+        json.dump(self.state, open(self.path, "w"), ensure_ascii=False, indent=2)
+
+def strategy_agent(history: str, overview, portfolio=None):
+    """history: TrajectoryDigest.render() 결과"""
+    p = f"Strategic Advisor. History:\n{history}\nMarket: {overview}\n"
+    if portfolio: p += f"Portfolio (NAV/drawdown/Sharpe/turnover): {portfolio}\n"
+    p += "Task: Define strategy. Return concise professional text."
     return _llm_chat([{"role": "user", "content": p}], model=PRO_MODEL, temperature=0.5)
 
 def selection_agent(strat, cand):
     reports = "\n".join([f"- {c['name']} ({c['ticker']}): {c['scores']}" for c in cand])
     p = f"Expert stock-picker. Strategy: {strat}\nCandidates:\n{reports}\nSelect top 5. Return ONLY JSON with 'selected_stocks' and 'reasoning'."
-    try: return _extract_json(_llm_chat([{"role": "user", "content": p}], model=PRO_MODEL))
-    except: return {"selected_stocks": [{"stock_code": c['ticker'], "weight": 20} for c in cand[:5]]}
+    try: return _llm_chat([{"role": "user", "content": p}], model=PRO_MODEL, parse=_extract_json)
+    except Exception:
+        METRICS.incr("failures", "selection_agent")
+        return numeric_selection(strat, cand)
 
+@taped("trading_day", stub=lambda: datetime.now().strftime("%Y%m%d"))
 def get_latest_trading_day():
     today = datetime.now().strftime("%Y%m%d")
     try:
-        df = stock.get_market_ohlcv((datetime.now() - timedelta(days=10)).strftime("%Y%m%d"), today, "005930")
+        with METRICS.timed("krx"): df = stock.get_market_ohlcv((datetime.now() - timedelta(days=10)).strftime("%Y%m%d"), today, "005930")
         return df.index[-1].strftime("%Y%m%d")
-    except: return today
+    except Exception:
+        METRICS.incr("failures", "trading_day"); return today
 
+@taped("market_overview")
 def get_market_overview() -> str:
     try:
         end = get_latest_trading_day(); start = (datetime.strptime(end, "%Y%m%d") - timedelta(days=30)).strftime("%Y%m%d")
-        df = stock.get_market_ohlcv(start, end, "101", market="KOSDAQ")
-        news = [t.text.strip() for t in BeautifulSoup(requests.get("https://finance.naver.com/news/mainnews.naver", headers={"User-Agent":"Mozilla/5.0"}).text, "html.parser").select(".mainnews_list .articleSubject a")[:3]]
+        with METRICS.timed("krx"): df = stock.get_market_ohlcv(start, end, "101", market="KOSDAQ")
+        news = [t.text.strip() for t in BeautifulSoup(_http_get("https://finance.naver.com/news/mainnews.naver").text, "html.parser").select(".mainnews_list .articleSubject a")[:3]]
         return f"KOSDAQ: {df['종가'].iloc[-1]}. News: {', '.join(news)}"
-    except: return "Stable market."
+    except Exception:
+        METRICS.incr("failures", "market_overview"); return "Stable market."
 
-def calculate_performance(trajectory: List[Dict]) -> List[Dict]:
-    if not trajectory: return []
-    all_t = set()
+# --- Streaming Pipeline (수집 → 채점) ---
+
+PIPELINE_QUEUE_SIZE = int(os.getenv("PIPELINE_QUEUE_SIZE", 20))
+PIPELINE_BATCH_WAIT = 0.5  # 배치를 채우기 위해 다음 종목을 기다리는 최대 시간(초)
+
+def run_pipeline(universe: List[str], db: StockDatabase, batch_size: int = SCORE_BATCH_SIZE,
+                 workers: int = SCORE_WORKERS, resume: bool = True) -> Tuple[Dict[str, Dict], Dict[str, Dict[str, int]], int]:
+    """수집과 채점을 겹쳐 실행하는 producer/consumer 파이프라인
+
+    수집된 종목은 DB에 저장되는 즉시 bounded queue를 통해 채점 워커로 넘어간다.
+    큐가 차면 수집 측이 대기한다(backpressure). 입력 지문이 직전 채점과 같으면 점수를 재사용.
+    resume이면 run_ledger에 기록된 단계는 건너뛴다 (수집만 끝난 종목은 DB에서 읽어 채점만).
+    반환: (raw dict, 점수, 재사용 종목 수)
+    """
+    force = os.getenv("FORCE_RESCORE", "0").strip() == "1"
+    prior = db.get_scores(universe)
+    q: "queue.Queue[Optional[Dict]]" = queue.Queue(maxsize=PIPELINE_QUEUE_SIZE)
+    raws: Dict[str, Dict] = {}
+    scores: Dict[str, Dict[str, int]] = {}
+    reused = []
+
+    done = db.ledger(universe) if resume else {}
+    if done:
+        raws.update(db.get_stocks([t for t in universe if "collected" in done.get(t, ())]))
+        scores.update({t: r['scores'] for t, r in raws.items() if "scored" in done[t] and r['scores']})
+        print(f" Resume: {len(raws)} collected, {len(scores)} scored, {len(universe) - len(raws)} to collect")
+
+    def _score(chunk: List[Dict]):
+        todo, fps = [], {}
+        for raw in chunk:
+            t = raw['ticker']; fps[t] = input_fingerprint(raw)
+            prev_scores, prev_fp = prior.get(t, (None, None))
+            if not force and prev_scores and prev_fp == fps[t]:
+                scores[t] = prev_scores; reused.append(t)
+                db.save_scores(t, prev_scores, fps[t])
+            else: todo.append(raw)
+        if not todo: return
+        fresh = batch_score_agent(todo) if batch_size > 0 else {r['ticker']: analyze_stock(r) for r in todo}
+        for t, sc in fresh.items():
+            scores[t] = sc; db.save_scores(t, sc, fps[t]); print(f" Score {t}: {sc}")
+
+    def _worker():
+        done = False
+        while not done:
+            chunk = []
+            raw = q.get()
+            if raw is None: return
+            chunk.append(raw)
+            while len(chunk) < max(batch_size, 1):
+                try: raw = q.get(timeout=PIPELINE_BATCH_WAIT)
+                except queue.Empty: break
+                if raw is None: done = True; break
+                chunk.append(raw)
+            try: _score(chunk)
+            except Exception as e:
+                METRICS.incr("failures", "analyze"); print(f"[Analyze Error] {[r['ticker'] for r in chunk]}: {e}")
+                # 리포트에서 빠지지 않도록 남은 종목은 기본 점수로 기록 (지문 없이 저장돼 다음 실행에 재채점)
+                for r in chunk:
+                    if r['ticker'] not in scores:
+                        scores[r['ticker']] = fallback_scores(); db.save_scores(r['ticker'], scores[r['ticker']], None)
+
+    async def _emit(raw):
+        raws[raw['ticker']] = raw
+        db.update_stock(raw); print(f" Saved DB: {raw['ticker']}")
+        await asyncio.to_thread(q.put, raw)
+
+    pool = [threading.Thread(target=_worker, name=f"analyze-{i}", daemon=True) for i in range(workers)]
+    for th in pool: th.start()
+    try:
+        for t, raw in list(raws.items()):
+            if t not in scores: q.put(raw)
+        todo = [t for t in universe if t not in raws]
+        if todo: collect_universe(todo, on_result=_emit)
+    finally:
+        for _ in pool: q.put(None)
+        for th in pool: th.join()
+    return raws, scores, len(reused)
+
+SHARD_CHUNK = int(os.getenv("SHARD_CHUNK", 50))  # 작업 큐에 넣는 단위 (종목 수)
+
+def _shard_worker(work_q, result_q, db_path: str, asof_date: str, batch_size: int, shards: int):
+    """샤드 워커 프로세스: 작업 큐에서 종목 묶음을 꺼내 run_pipeline 실행. 결과는 공유 DB에 기록"""
+    global HOST_LIMITS, LLM_RPM
+    # 프로세스들이 외부 호스트·LLM 한도를 나눠 쓴다
+    HOST_LIMITS = {h: max(1, n // shards) for h, n in HOST_LIMITS.items()}
+    LLM_RPM = {m: max(1, n // shards) for m, n in LLM_RPM.items()}
+    db = StockDatabase(db_path, asof_date=asof_date)
+    reused = 0
+    try:
+        while True:
+            chunk = work_q.get()
+            if chunk is None: break
+            reused += run_pipeline(chunk, db, batch_size, workers=max(1, SCORE_WORKERS // shards))[2]
+    finally:
+        db.close()
+        result_q.put(reused)
+
+def run_sharded(universe: List[str], db: StockDatabase, shards: int, batch_size: int = SCORE_BATCH_SIZE,
+                resume: bool = True) -> Tuple[Dict[str, Dict], Dict[str, Dict[str, int]], int]:
+    """유니버스를 SHARD_CHUNK 단위로 로컬 작업 큐에 넣고 shards개 프로세스가 나눠 처리한 뒤 DB에서 병합
+
+    시장 스냅샷과 일봉은 부모가 한 번에 받아 두어 워커는 캐시만 읽는다. 반환은 run_pipeline과 같다.
+    """
+    done = db.ledger(universe) if resume else {}
+    pending = [t for t in universe if "scored" not in done.get(t, ())]
+    reused = 0
+    print(f" Sharding {len(pending)}/{len(universe)} names across {shards} processes")
+    if pending:
+        suffix_market = {v: k for k, v in MARKET_SUFFIX.items()}
+        load_market_snapshot(sorted({suffix_market[t.split(".")[1]] for t in pending if t.split(".")[-1] in suffix_market}))
+        if not (TAPE and TAPE.mode == "replay"):
+            try: get_ohlcv_store().ensure(pending, (datetime.now() - timedelta(days=OHLCV_HISTORY_DAYS)).strftime("%Y-%m-%d"))
+            except Exception as e: print(f"[Panel Error] {e}")
+        db.flush()
+        ctx = multiprocessing.get_context("spawn")
+        work_q, result_q = ctx.Queue(), ctx.Queue()
+        for i in range(0, len(pending), SHARD_CHUNK): work_q.put(pending[i:i + SHARD_CHUNK])
+        for _ in range(shards): work_q.put(None)
+        procs = [ctx.Process(target=_shard_worker, args=(work_q, result_q, db.db_path, db.asof_date, batch_size, shards), name=f"shard-{i}")
+                 for i in range(shards)]
+        for p in procs: p.start()
+        for p in procs: p.join()
+        failed = [p.name for p in procs if p.exitcode != 0]
+        if failed: print(f"[Shard Error] {failed} exited abnormally; rerun to resume from the ledger")
+        while True:
+            try: reused += result_q.get(timeout=0.1)
+            except queue.Empty: break
+    snapshot = db.get_stocks(universe)
+    return snapshot, {t: r['scores'] for t, r in snapshot.items() if r['scores']}, reused
+
+# --- Universe Screening (LLM 이전 단계의 정량 필터) ---
+
+UNIVERSE_PATH = os.path.join(STATE_DIR, "kosdaq_universe.json")
+UNIVERSE_MARKETS = [m.strip().upper() for m in os.getenv("UNIVERSE_MARKETS", "KOSDAQ").split(",") if m.strip()]
+SHORTLIST_K = int(os.getenv("SHORTLIST_K", 30))
+SCREEN_MIN_AMOUNT = float(os.getenv("SCREEN_MIN_AMOUNT", 1e9))  # 일 거래대금 하한 (원)
+SCREEN_MOMENTUM_DAYS = 30
+# 특징별 가중치 (환경변수 SCREEN_WEIGHTS='{"momentum": 0.5, ...}'로 덮어쓰기)
+SCREEN_WEIGHTS = {"size": 0.3, "liquidity": 0.2, "momentum": 0.3, "value": 0.2, **json.loads(os.getenv("SCREEN_WEIGHTS", "{}"))}
+def fetch_screen_features(market: str = "KOSDAQ", asof: Optional[str] = None) -> pd.DataFrame:
+    """시장 전체 종목의 스크리닝 특징을 벌크 호출 3회로 수집 (index: 종목코드)"""
+    asof = asof or get_latest_trading_day()
+    with METRICS.timed("krx"): listing = fdr.StockListing(market).set_index('Code')
+    features = pd.DataFrame({"name": listing['Name'], "marcap": listing['Marcap'], "amount": listing['Amount']})
+    try:
+        start = (datetime.strptime(asof, "%Y%m%d") - timedelta(days=SCREEN_MOMENTUM_DAYS)).strftime("%Y%m%d")
+        with METRICS.timed("krx"): features["momentum"] = stock.get_market_price_change_by_ticker(start, asof, market=market)['등락률']
+    except Exception as e: print(f"[Screen] momentum unavailable: {e}")
+    try:
+        with METRICS.timed("krx"): fund = stock.get_market_fundamental_by_ticker(asof, market=market)
+        features["per"], features["pbr"] = fund['PER'], fund['PBR']
+    except Exception as e: print(f"[Screen] valuation unavailable: {e}")
+    return features
+
+def rank_weighted_score(features: pd.DataFrame, weights: Optional[Dict[str, float]] = None) -> pd.Series:
+    """특징별 백분위 순위의 가중합. 결측 특징은 중립(0.5)으로 처리"""
+    weights = weights or SCREEN_WEIGHTS
+    cols = features.columns
+    per = features["per"] if "per" in cols else pd.Series(np.nan, index=features.index)
+    pbr = features["pbr"] if "pbr" in cols else pd.Series(np.nan, index=features.index)
+    f = pd.DataFrame({
+        "size": np.log1p(features["marcap"]),
+        "liquidity": np.log1p(features["amount"]),
+        "momentum": features["momentum"] if "momentum" in cols else np.nan,
+        # 이익수익률 + 순자산수익률 (적자/자본잠식은 0)
+        "value": (1 / per.where(per > 0)).fillna(0) + (1 / pbr.where(pbr > 0)).fillna(0),
+    }, index=features.index)
+    ranks = f.rank(pct=True).fillna(0.5)
+    w = pd.Series({k: weights.get(k, 0.0) for k in ranks.columns})
+    return ranks.mul(w, axis=1).sum(axis=1)
+
+def screen_universe(k: int = SHORTLIST_K, market: str = "KOSDAQ", scorer=rank_weighted_score,
+                    weights: Optional[Dict[str, float]] = None) -> List[str]:
+    """시장 전체를 정량 점수로 순위화해 상위 k개만 LLM 분석 대상으로 반환"""
+    suffix = MARKET_SUFFIX[market]
+    path = UNIVERSE_PATH if market == "KOSDAQ" else os.path.join(STATE_DIR, f"{market.lower()}_universe.json")
+    try:
+        features = fetch_screen_features(market)
+    except Exception as e:
+        print(f"[Screen Error] {e}")
+        try: return json.load(open(path))["tickers"][:k]
+        except Exception:
+            METRICS.incr("failures", "universe_cache"); return []
+    json.dump({"asof": datetime.now().strftime("%Y-%m-%d"), "tickers": [f"{c}.{suffix}" for c in features.index]},
+              open(path, "w"), ensure_ascii=False, indent=2)
+    liquid = features[features["amount"] >= SCREEN_MIN_AMOUNT]
+    if len(liquid) >= k: features = liquid
+    ranked = scorer(features, weights).sort_values(ascending=False)
+    print(f" Screened {len(features)} {market} names -> shortlist {min(k, len(ranked))}")
+    return [f"{c}.{suffix}" for c in ranked.index[:k]]
+
+def screen_markets(markets: Optional[List[str]] = None, k: int = SHORTLIST_K) -> List[str]:
+    """시장별 shortlist를 합친 유니버스 (KOSPI+KOSDAQ 등)"""
+    return [t for m in (markets or UNIVERSE_MARKETS) for t in screen_universe(k, market=m)]
+
+# --- Portfolio Analytics ---
+
+PORTFOLIO_STATE_PATH = os.path.join(STATE_DIR, "portfolio_analytics.json")
+TRADING_DAYS = 252
+
+def _normalize_code(code: Any) -> Optional[str]:
+    m = re.search(r'(\d{6}\.K[SQ])', str(code).upper())
+    return m.group(1) if m else None
+
+def trajectory_tickers(trajectory: List[Dict]) -> List[str]:
+    codes = {_normalize_code(s.get("stock_code") if isinstance(s, dict) else s)
+             for e in trajectory for key in ("selected", "baseline") for s in e.get(key, [])}
+    return sorted(c for c in codes if c)
+
+def load_close_panel(tickers: List[str], start: str) -> pd.DataFrame:
+    """보유 종목 종가 패널(date×ticker). 증분 일봉 저장소를 공유"""
+    if not tickers: return pd.DataFrame()
+    return get_ohlcv_store().load(tickers, start, fields=("close",))["close"]
+
+def trajectory_weights(trajectory: List[Dict], dates: pd.DatetimeIndex) -> pd.DataFrame:
+    """trajectory를 date×holding 비중 행렬로 변환. 각 선택은 다음 리밸런싱까지 유지"""
+    rebalances = {}
     for e in trajectory:
+        w: Dict[str, float] = {}
         for s in e.get("selected", []):
-            code = s.get("stock_code") if isinstance(s, dict) else str(s)
-            match = re.search(r'(\d{6}\.K[SQ])', str(code).upper())
-            if match: all_t.add(match.group(1))
+            code = _normalize_code(s.get("stock_code")) if isinstance(s, dict) else None
+            if code: w[code] = w.get(code, 0.0) + float(s.get("weight", 1) or 0)
+        total = sum(w.values())
+        rebalances[pd.Timestamp(e["date"])] = {t: v / total for t, v in w.items()} if total > 0 else {}
+    if not rebalances: return pd.DataFrame(index=dates)
+    weights = pd.DataFrame.from_dict(rebalances, orient="index").fillna(0.0).sort_index()
+    # 리밸런싱일이 휴장일이어도 다음 거래일부터 반영되도록 합집합 위에서 ffill
+    return weights.reindex(weights.index.union(dates)).ffill().reindex(dates).fillna(0.0)
+
+class PortfolioAnalytics:
+    """trajectory 비중 행렬 × 종가 패널로 NAV, 낙폭, 샤프, 회전율을 계산 (일 단위 증분 갱신)"""
+    def __init__(self, path: str = PORTFOLIO_STATE_PATH):
+        self.path = path
+        self.state = {"last_date": None, "nav": 1.0, "peak": 1.0, "max_drawdown": 0.0, "n": 0,
+                      "sum_ret": 0.0, "sum_sq": 0.0, "turnover": 0.0, "rebalances": 0, "last_weights": {}, "history": []}
+        if os.path.exists(path):
+            try: self.state.update(json.load(open(path)))
+            except Exception: METRICS.incr("failures", "state_file")
+
+    def update(self, trajectory: List[Dict], closes: pd.DataFrame) -> Dict[str, Any]:
+        """last_date 이후 새로 생긴 거래일만 반영"""
+        st = self.state
+        if closes.empty or not trajectory: return self.metrics()
+        dates = closes.index
+        weights = trajectory_weights(trajectory, dates)
+        rets = closes.pct_change(fill_method=None).reindex(columns=weights.columns).fillna(0.0)
+        held = weights.shift(1).fillna(0.0)
+        port = (held.to_numpy() * rets.to_numpy()).sum(axis=1)
+
+        first = pd.Timestamp(min(e["date"] for e in trajectory))
+        new = (dates > pd.Timestamp(st["last_date"])) if st["last_date"] else (dates > first)
+        if not new.any(): return self.metrics()
+        r = port[new]
+        navs = st["nav"] * np.cumprod(1 + r)
+        peaks = np.maximum.accumulate(np.concatenate([[st["peak"]], navs]))[1:]
+        drawdowns = navs / peaks - 1
+
+        w_new = weights.to_numpy()[new]
+        prev_row = weights.shift(1).to_numpy()[new]
+        prev_row[0] = [st["last_weights"].get(t, 0.0) for t in weights.columns]
+        turns = 0.5 * np.abs(w_new - prev_row).sum(axis=1)
+
+        st.update({
+            "last_date": dates[new][-1].strftime("%Y-%m-%d"), "nav": float(navs[-1]), "peak": float(peaks[-1]),
+            "max_drawdown": float(min(st["max_drawdown"], drawdowns.min())), "n": st["n"] + len(r),
+            "sum_ret": st["sum_ret"] + float(r.sum()), "sum_sq": st["sum_sq"] + float((r ** 2).sum()),
+            "turnover": st["turnover"] + float(turns.sum()), "rebalances": st["rebalances"] + int((turns > 1e-9).sum()),
+            "last_weights": {t: float(v) for t, v in zip(weights.columns, w_new[-1]) if v > 0},
+        })
+        st["history"] += [{"date": d.strftime("%Y-%m-%d"), "nav": round(float(n), 6), "ret": round(float(x) * 100, 3), "drawdown": round(float(dd) * 100, 3)}
+                          for d, n, x, dd in zip(dates[new], navs, r, drawdowns)]
+        self.save()
+        return self.metrics()
+
+    def metrics(self) -> Dict[str, Any]:
+        st, n = self.state, self.state["n"]
+        mean = st["sum_ret"] / n if n else 0.0
+        std = float(np.sqrt(max(st["sum_sq"] / n - mean ** 2, 0.0) * n / (n - 1))) if n > 1 else 0.0
+        return {
+            "asof": st["last_date"], "days": n,
+            "nav": round(st["nav"], 4), "total_return": round((st["nav"] - 1) * 100, 2),
+            "drawdown": round((st["nav"] / st["peak"] - 1) * 100, 2), "max_drawdown": round(st["max_drawdown"] * 100, 2),
+            "volatility": round(std * np.sqrt(TRADING_DAYS) * 100, 2),
+            "sharpe": round(mean / std * np.sqrt(TRADING_DAYS), 2) if std > 0 else None,
+            "avg_turnover": round(st["turnover"] / st["rebalances"], 3) if st["rebalances"] else 0.0,
+        }
+
+    def save(self):
+        json.dump(self.state, open(self.path, "w"), ensure_ascii=False, indent=2)
+
+def calculate_performance(trajectory: List[Dict], closes: Optional[pd.DataFrame] = None) -> List[Dict]:
+    """종목별 현재가/수익률과 일자별 가중 수익률(perf) 갱신. closes는 load_close_panel 결과"""
+    if not trajectory: return []
+    all_t = trajectory_tickers(trajectory)
     if not all_t: return trajectory
-    curr_p = {}
-    try:
-        data = yf.download(" ".join(list(all_t)), period="1d", progress=False)
-        for t in all_t:
-            try:
-                p_col = data['Close'][t] if len(all_t) > 1 else data['Close']
-                if not p_col.empty: curr_p[t] = float(p_col.iloc[-1].iloc[0]) if hasattr(p_col.iloc[-1], 'iloc') else float(p_col.iloc[-1])
-            except: continue
-    except: pass
+    if closes is None:
+        closes = load_close_panel(all_t, min(e["date"] for e in trajectory))
+    last = closes.ffill().iloc[-1] if not closes.empty else pd.Series(dtype=float)
+    curr_p = {t: float(v) for t, v in last.items() if pd.notna(v)}
     for e in trajectory:
-        total_ret, total_w = 0.0, 0.0
-        for s in e.get("selected", []):
-            if not isinstance(s, dict): continue
-            m = re.search(r'(\d{6}\.K[SQ])', str(s.get("stock_code")).upper())
-            code = m.group(1) if m else s.get("stock_code")
-            buy_p, w = s.get("buy_price"), s.get("weight", 1)
-            if code in curr_p and buy_p and buy_p > 0:
-                ret = ((curr_p[code] / buy_p) - 1) * 100
-                s["current_price"] = int(curr_p[code]); s["return"] = round(ret, 2)
-                total_ret += ret * w; total_w += w
-        if total_w > 0: e["perf"] = round(total_ret / total_w, 2)
+        # selected: 실제 선택, baseline: 같은 날 numeric_selection 선택 (비교용)
+        for key, perf_key in (("selected", "perf"), ("baseline", "baseline_perf")):
+            total_ret, total_w = 0.0, 0.0
+            for s in e.get(key, []):
+                if not isinstance(s, dict): continue
+                code = _normalize_code(s.get("stock_code")) or s.get("stock_code")
+                buy_p, w = s.get("buy_price"), s.get("weight", 1)
+                if code in curr_p and buy_p and buy_p > 0:
+                    ret = ((curr_p[code] / buy_p) - 1) * 100
+                    s["current_price"] = int(curr_p[code]); s["return"] = round(ret, 2)
+                    total_ret += ret * w; total_w += w
+            if total_w > 0: e[perf_key] = round(total_ret / total_w, 2)
     return trajectory
 
+# --- Numeric Selection (LLM 없는 종목 선택) ---
+
+SELECTION_MODE = os.getenv("SELECTION_MODE", "llm").strip().lower()  # "llm" | "numeric"
+SELECT_MAX_WEIGHT = float(os.getenv("SELECT_MAX_WEIGHT", 0.35))       # 종목별 비중 상한
+SELECT_MIN_WEIGHT = float(os.getenv("SELECT_MIN_WEIGHT", 0.05))       # 종목별 비중 하한 (선택한 k종목이 모두 편입되도록)
+SELECT_RISK_AVERSION = float(os.getenv("SELECT_RISK_AVERSION", 1.0))  # 공분산 페널티 계수
+SELECT_LOOKBACK_DAYS = 120
+# 전략 텍스트에서 차원 강조를 찾는 키워드 (소문자 부분 일치)
+_DIMENSION_KEYWORDS = {
+    "financial_health": ["financial", "valuation", "재무", "건전", "밸류"],
+    "growth_potential": ["growth", "성장"],
+    "news_sentiment": ["sentiment", "심리"],
+    "news_impact": ["impact", "영향"],
+    "price_momentum": ["momentum", "모멘텀", "추세"],
+    "volatility_risk": ["volatil", "risk", "변동성", "리스크", "안정"],
+}
+
+def strategy_dimension_weights(strategy: str) -> Dict[str, float]:
+    """전략 텍스트에서 언급된 차원일수록 큰 가중치 (1 + 언급 횟수, 합 1로 정규화)"""
+    text = (strategy or "").lower()
+    raw = {d: 1.0 + sum(text.count(k) for k in _DIMENSION_KEYWORDS[d]) for d in SCORING_DIMENSIONS}
+    total = sum(raw.values())
+    return {d: v / total for d, v in raw.items()}
+
+def return_covariance(tickers: List[str], closes: Optional[pd.DataFrame] = None, lookback: int = SELECT_LOOKBACK_DAYS) -> np.ndarray:
+    """일봉 저장소 종가로 연율화 공분산 (대각 방향 50% 축소). 이력이 부족한 종목은 중앙값 분산, 공분산 0"""
+    if closes is None:
+        start = (datetime.now() - timedelta(days=lookback)).strftime("%Y-%m-%d")
+        closes = pd.DataFrame() if TAPE and TAPE.mode == "replay" else load_close_panel(tickers, start)
+    rets = closes.reindex(columns=tickers).pct_change(fill_method=None)
+    cov = rets.cov(min_periods=20).to_numpy() * TRADING_DAYS
+    diag = np.diag(cov)
+    var = np.where(np.isfinite(diag), diag, np.nanmedian(diag) if np.isfinite(diag).any() else 0.1)
+    cov = np.where(np.isfinite(cov), cov, 0.0)
+    np.fill_diagonal(cov, var)
+    return 0.5 * cov + 0.5 * np.diag(var)
+
+def _project_capped_simplex(v: np.ndarray, cap: float, floor: float = 0.0) -> np.ndarray:
+    """{w | Σw = 1, floor ≤ w ≤ cap} 위로의 유클리드 투영 (이분법)"""
+    lo, hi = v.min() - cap, v.max() - floor
+    for _ in range(40):
+        tau = (lo + hi) / 2
+        if np.clip(v - tau, floor, cap).sum() > 1: lo = tau
+        else: hi = tau
+    return np.clip(v - (lo + hi) / 2, floor, cap)
+
+def optimize_weights(mu: np.ndarray, cov: np.ndarray, cap: float, risk_aversion: float, iters: int = 300,
+                     floor: float = 0.0) -> np.ndarray:
+    """max μᵀw − λ·wᵀΣw (Σw = 1, floor ≤ w ≤ cap). 투영 경사 상승법"""
+    n = len(mu)
+    step = 1.0 / max(2 * risk_aversion * float(np.linalg.eigvalsh(cov).max()), 1.0) if n else 1.0
+    w = np.full(n, 1.0 / n)
+    for _ in range(iters):
+        w, prev = _project_capped_simplex(w + step * (mu - 2 * risk_aversion * cov @ w), cap, floor), w
+        if np.abs(w - prev).max() < 1e-6: break
+    return w
+
+def numeric_selection(strategy: str, cand: List[Dict], k: int = MAX_PORTFOLIO_STOCKS, closes: Optional[pd.DataFrame] = None,
+                      cap: float = SELECT_MAX_WEIGHT, risk_aversion: float = SELECT_RISK_AVERSION,
+                      floor: float = SELECT_MIN_WEIGHT) -> Dict[str, Any]:
+    """점수 행렬 × 전략 차원 가중치를 기대 효용으로, 공분산 페널티와 종목별 상한 아래에서 k종목과 비중을 결정
+
+    종목은 동일 비중 효용 기준 greedy로 고르고 비중은 optimize_weights로 정한다.
+    selection_agent와 같은 형식({"selected_stocks": [...], "reasoning": ...})을 반환한다.
+    """
+    if not cand: return {"selected_stocks": [], "reasoning": "no candidates"}
+    dims = strategy_dimension_weights(strategy)
+    tickers = [c['ticker'] for c in cand]
+    scores = np.array([[c['scores'].get(d, 5) for d in SCORING_DIMENSIONS] for c in cand], dtype=float) / 10
+    mu = scores @ np.array([dims[d] for d in SCORING_DIMENSIONS])
+    cov = return_covariance(tickers, closes)
+    k = min(k, len(cand)); cap, floor = max(cap, 1.0 / k), min(floor, 1.0 / k)
+    chosen: List[int] = []
+    for _ in range(k):
+        rest = [i for i in range(len(cand)) if i not in chosen]
+        util = [mu[chosen + [i]].mean() - risk_aversion * cov[np.ix_(chosen + [i], chosen + [i])].mean() for i in rest]
+        chosen.append(rest[int(np.argmax(util))])
+    w = optimize_weights(mu[chosen], cov[np.ix_(chosen, chosen)], cap, risk_aversion, floor=floor)
+    # 정수 % 비중 (최대 잉여 방식으로 합 100)
+    pct = np.floor(w * 100 + 1e-9).astype(int)
+    for i in np.argsort(-(w * 100 - pct))[:100 - int(pct.sum())]: pct[i] += 1
+    top = max(dims, key=dims.get)
+    emphasis = top if dims[top] > 1.0 / len(dims) + 1e-9 else "balanced"
+    return {"selected_stocks": [{"stock_code": tickers[i], "weight": int(p)} for i, p in zip(chosen, pct) if p > 0],
+            "reasoning": f"numeric optimizer (emphasis: {emphasis}, risk aversion {risk_aversion}, cap {cap:.0%})"}
+
 # --- Main Execution ---
 
-def main():
-    print("3S-Trader KR: RDB(SQLite) & Multi-Agent Pipeline Centric Mode")
-    today_str = datetime.now().strftime('%Y-%m-%d')
-    db = StockDatabase(DB_PATH)
-    
-    # 1. Collection Phase
-    print("Step 1: Pipeline - Collecting raw data to SQLite...")
-    universe = [f"{c}.KQ" for c in fdr.StockListing('KOSDAQ').sort_values(by='Marcap', ascending=False).head(30)['Code'].tolist()]
-    with ThreadPoolExecutor(max_workers=10) as ex:
-        futures = {ex.submit(collect_stock_data, t): t for t in universe}
-        for fut in as_completed(futures):
-            raw = fut.result()
-            if raw: db.update_stock(raw); print(f" Saved DB: {raw['ticker']}")
-    
-    # 2. Analysis Phase
-    print("\nStep 2: Experts - Analyzing from SQLite...")
-    scored_universe = []
-    def analyze_task(t):
-        raw = db.get_stock(t)
-        if not raw: return None
-        n, te, f = news_agent(raw), technical_agent(raw), fundamental_agent(raw)
-        res = score_agent(raw, n, f, te)
-        print(f" Score {t}: {res['scores']}")
-        return {"ticker": t, "name": raw['name'], "scores": res['scores'], "price": raw['technical']['price']}
-
-    with ThreadPoolExecutor(max_workers=5) as ex:
-        futures = [ex.submit(analyze_task, t) for t in universe]
-        for fut in as_completed(futures):
-            r = fut.result()
-            if r: scored_universe.append(r)
-            
-    # 3. Strategy & Selection
-    trajectory = []
+def _scored_universe(snapshot: Dict[str, Dict], scores: Dict[str, Dict[str, int]], order: Optional[List[str]] = None) -> List[Dict]:
+    return [{"ticker": t, "name": snapshot[t]['name'], "scores": scores[t], "price": snapshot[t]['technical']['price']}
+            for t in (order or list(snapshot)) if t in snapshot and t in scores]
+
+def run_analyze(db: StockDatabase, tickers: Optional[List[str]] = None,
+                batch_size: int = SCORE_BATCH_SIZE) -> Tuple[Dict[str, Dict], Dict[str, Dict[str, int]], int]:
+    """DB에 저장된 해당 일자 스냅샷을 채점 (입력 지문이 같으면 재사용). 반환: (snapshot, 점수, 재사용 수)"""
+    snapshot = db.get_stocks(tickers)
+    force = os.getenv("FORCE_RESCORE", "0").strip() == "1"
+    prior = db.get_scores(list(snapshot))
+    scores = {}
+    for t, raw in snapshot.items():
+        prev_scores, prev_fp = prior.get(t, (None, None))
+        if not force and prev_scores and prev_fp == raw['input_hash']:
+            scores[t] = prev_scores; db.save_scores(t, prev_scores, raw['input_hash'])
+    reused = len(scores)
+    def _on_scored(t, sc):
+        db.save_scores(t, sc, snapshot[t]['input_hash']); print(f" Score {t}: {sc}")
+    scores.update(score_universe([r for t, r in snapshot.items() if t not in scores], batch_size, on_scored=_on_scored))
+    return snapshot, scores, reused
+
+def load_trajectory() -> List[Dict]:
     if os.path.exists(STRATEGY_STATE_PATH):
-        try: trajectory = json.load(open(STRATEGY_STATE_PATH)).get("trajectory", [])
-        except: pass
-    
-    current_strategy = strategy_agent(trajectory, get_market_overview())
+        try: return json.load(open(STRATEGY_STATE_PATH)).get("trajectory", [])
+        except Exception: METRICS.incr("failures", "state_file")
+    return []
+
+def save_trajectory(trajectory: List[Dict]):
+    json.dump({"trajectory": trajectory[-TRAJECTORY_K:]}, open(STRATEGY_STATE_PATH, 'w'), ensure_ascii=False, indent=2)
+
+def run_perf(trajectory: List[Dict]) -> Tuple[List[Dict], Any, Dict[str, Any]]:
+    """보유 이력 성과 갱신. 반환: (trajectory, 종가 패널, 포트폴리오 지표)"""
+    held = trajectory_tickers(trajectory)
+    closes = load_close_panel(held, min(e["date"] for e in trajectory)) if held else pd.DataFrame()
+    trajectory = calculate_performance(trajectory, closes)
+    return trajectory, closes, PortfolioAnalytics().update(trajectory, closes)
+
+def run_select(snapshot: Dict[str, Dict], scored_universe: List[Dict], today_str: str,
+               db: Optional[StockDatabase] = None, mode: str = SELECTION_MODE) -> Tuple[str, List[Dict], Dict[str, Any]]:
+    """전략 수립 + 종목 선택 후 trajectory 저장. 반환: (전략, 선택 종목, 포트폴리오 지표)
+
+    db가 주어지면 전략·선택 결과를 체크포인트로 남기고, 이미 있으면 LLM 호출 없이 재사용한다.
+    mode="numeric"이면 선택을 numeric_selection으로 한다. 어느 모드든 numeric 선택을 baseline으로 함께 기록.
+    """
+    # 보유 이력 성과 갱신 (오늘 편입분은 내일부터 수익률에 반영되므로 전략 수립 전에 계산)
+    with METRICS.stage("performance"):
+        trajectory, closes, portfolio = run_perf(load_trajectory())
+    print(f" Portfolio: {portfolio}")
+
+    current_strategy = db.get_checkpoint("strategy") if db else None
+    if current_strategy is None:
+        with METRICS.stage("strategy"):
+            digest = TrajectoryDigest(); digest.update(trajectory)
+            history = digest.render()
+            tokens = count_tokens(history); METRICS.incr("digest_tokens", "strategy", tokens)
+            print(f" Trajectory digest: {tokens} tokens (budget {DIGEST_TOKEN_BUDGET})")
+            current_strategy = strategy_agent(history, get_market_overview(), portfolio)
+        if db: db.checkpoint("strategy", current_strategy)
+    else: print(" Resume: strategy from checkpoint")
     scored_sorted = sorted(scored_universe, key=lambda x: sum(x['scores'].values()), reverse=True)
-    sel_res = selection_agent(current_strategy, scored_sorted[:30])
-    final_stocks = sel_res.get("selected_stocks", [])
+    with METRICS.stage("selection_numeric"):
+        baseline = numeric_selection(current_strategy, scored_sorted[:30])["selected_stocks"]
+    final_stocks = db.get_checkpoint("selection") if db else None
+    if final_stocks is None:
+        with METRICS.stage("selection"):
+            final_stocks = baseline if mode == "numeric" else selection_agent(current_strategy, scored_sorted[:30]).get("selected_stocks", [])
+        if db: db.checkpoint("selection", final_stocks)
+    else: print(" Resume: selection from checkpoint")
+    overlap = len({s.get('stock_code') for s in final_stocks} & {s['stock_code'] for s in baseline})
+    print(f" Numeric baseline: {[s['stock_code'] for s in baseline]} (overlap {overlap}/{len(final_stocks)})")
     
-    for s in final_stocks:
-        raw = db.get_stock(s.get('stock_code',''))
+    for s in final_stocks + baseline:
+        raw = snapshot.get(s.get('stock_code',''))
         if raw: s['buy_price'] = raw['technical']['price']
     
-    today_entry = {"date": today_str, "strategy": current_strategy, "selected": final_stocks, "perf": 0.0}
+    today_entry = {"date": today_str, "strategy": current_strategy, "selected": final_stocks, "perf": 0.0, "baseline": baseline}
     found_idx = next((i for i, e in enumerate(trajectory) if e.get("date") == today_str), -1)
     if found_idx >= 0: trajectory[found_idx] = today_entry
     else: trajectory.append(today_entry)
     
-    trajectory = calculate_performance(trajectory)
-    json.dump({"trajectory": trajectory[-TRAJECTORY_K:]}, open(STRATEGY_STATE_PATH, 'w'), ensure_ascii=False, indent=2)
+    save_trajectory(calculate_performance(trajectory, closes))
+    return current_strategy, final_stocks, portfolio
 
-    # 4. Report
+def write_report(today_str: str, current_strategy: str, final_stocks: List[Dict], scored_universe: List[Dict],
+                 portfolio: Dict[str, Any], reused: Optional[int] = None) -> str:
     filename = f"reports/3S_Trader_Report_{today_str}.md"; os.makedirs("reports", exist_ok=True)
     with open(filename, "w", encoding="utf-8") as f:
-        f.write(f"# 3S-Trader KR 전략 리포트 ({today_str})\n\n## 🧠 1. Strategy\n{current_strategy}\n\n## 🎯 3. Selection\n")
+        f.write(f"# 3S-Trader KR 전략 리포트 ({today_str})\n\n")
+        if reused is not None: f.write(f"> 채점 재사용: {reused}/{len(scored_universe)} 종목 (입력 변경 없음)\n\n")
+        f.write(f"## 🧠 1. Strategy\n{current_strategy}\n\n## 🎯 3. Selection\n")
         sel_tickers = [s.get('stock_code','') for s in final_stocks]
         final_data = [s for s in scored_universe if s['ticker'] in sel_tickers]
         if final_data: f.write(pd.DataFrame(final_data).to_markdown(index=False) + "\n\n")
+        f.write(f"## 📈 Portfolio\n{pd.DataFrame([portfolio]).to_markdown(index=False)}\n\n")
+        bench = [{"date": e["date"], "perf": e.get("perf"), "baseline_perf": e.get("baseline_perf"),
+                  "overlap": len({s.get("stock_code") for s in e.get("selected", [])} & {s.get("stock_code") for s in e["baseline"]})}
+                 for e in load_trajectory() if e.get("baseline")]
+        if bench: f.write(f"## ⚖️ Selection vs Numeric Baseline\n{pd.DataFrame(bench).to_markdown(index=False)}\n\n")
         f.write("## 📊 4. Scoring Detail\n")
         f.write(pd.DataFrame(scored_universe).to_markdown(index=False))
+    return filename
+
+def main(resume: bool = True, shards: int = 0, markets: Optional[List[str]] = None):
+    """전체 실행. resume이면 같은 거래일의 중단된 실행을 진행 기록(run_ledger)부터 이어서, shards > 1이면 다중 프로세스로 수집·채점
+
+    같은 거래일의 실행이 이미 끝났으면(complete 체크포인트) 이어받지 않고 다시 수집한다 (입력이 같은 종목은 점수 재사용).
+    """
+    print("3S-Trader KR: RDB(SQLite) & Multi-Agent Pipeline Centric Mode")
+    today_str = datetime.now().strftime('%Y-%m-%d')
+    asof_date = datetime.strptime(get_latest_trading_day(), "%Y%m%d").strftime("%Y-%m-%d")
+    db = StockDatabase(DB_PATH, asof_date=asof_date)
+    if db.get_checkpoint("complete") is not None: print(" Previous run for this trading day completed; starting a fresh run")
+    if not resume or db.get_checkpoint("complete") is not None: db.reset_run()
+    
+    # 1-2. Collection → Analysis (streaming)
+    universe = db.get_checkpoint("universe")
+    if universe is None:
+        with METRICS.stage("screen"):
+            universe = screen_markets(markets)
+        db.checkpoint("universe", universe)
+    else: print(f" Resume: universe from checkpoint ({len(universe)} names)")
+    print("Step 1-2: Pipeline - Collecting raw data to SQLite and analyzing as it arrives...")
+    with METRICS.stage("pipeline"):
+        if shards > 1: snapshot, scores, reused = run_sharded(universe, db, shards)
+        else: snapshot, scores, reused = run_pipeline(universe, db)
+    scored_universe = _scored_universe(snapshot, scores, universe)
+    print(f" Reused scores: {reused}/{len(snapshot)} (re-analyzed {len(snapshot) - reused})")
+
+    if get_llm_cache(): print(f" LLM cache: {get_llm_cache().stats}")
+    print(f" News store: {get_news_store().stats}")
+    with METRICS.stage("export"):
+        try: print(f" Parquet snapshot: {db.export_parquet()}")
+        except Exception as e: print(f"[Export Error] {e}")
+
+    # 3. Strategy & Selection
+    current_strategy, final_stocks, portfolio = run_select(snapshot, scored_universe, today_str, db)
+
+    # 4. Report
+    with METRICS.stage("report"):
+        filename = write_report(today_str, current_strategy, final_stocks, scored_universe, portfolio, reused)
+
+    db.checkpoint("complete", {"report": filename, "finished_at": datetime.now().isoformat()})
+    db.close()
+    manifest_path, _ = METRICS.write("reports", today_str, universe=len(universe), collected=len(snapshot), reused_scores=reused,
+                                     llm_cache=get_llm_cache().stats if get_llm_cache() else None, news=get_news_store().stats, report=filename)
+    print(f"Report: {filename} (metrics: {manifest_path})")
+
+# --- Daemon (상주 서비스 모드) ---
+
+DAEMON_HOST = os.getenv("DAEMON_HOST", "127.0.0.1")
+DAEMON_PORT = int(os.getenv("DAEMON_PORT", 8765))
+DAEMON_REFRESH_SECONDS = int(os.getenv("DAEMON_REFRESH_SECONDS", 600))  # 뉴스·시세 갱신 주기
+DAEMON_REPORT_TIME = os.getenv("DAEMON_REPORT_TIME", "19:00")             # 일일 선택·리포트 시각 (로컬 시각 HH:MM)
+DAEMON_RESCORE_MOVE = float(os.getenv("DAEMON_RESCORE_MOVE", 0.03))       # 채점 시점 대비 가격 변동이 이 이상이면 재채점
+
+class TraderDaemon:
+    """상주 모드: 유니버스·원천 데이터·점수를 메모리에 두고 주기적으로 바뀐 소스만 갱신
+
+    HTTP 세션, DB/캐시 연결(모듈 싱글턴)은 프로세스 수명 동안 유지된다. 거래일이 바뀌면
+    유니버스를 다시 스크리닝하고 수집·채점하며(run_ledger로 이어받기), 그 사이에는 뉴스와
+    당일 시세만 다시 받아 뉴스가 바뀌었거나 가격이 DAEMON_RESCORE_MOVE 이상 움직인 종목만 재채점한다.
+    """
+    def __init__(self, markets: Optional[List[str]] = None, interval: int = DAEMON_REFRESH_SECONDS,
+                 report_time: str = DAEMON_REPORT_TIME, batch_size: int = SCORE_BATCH_SIZE):
+        self.markets, self.interval, self.report_time, self.batch_size = markets, interval, report_time, batch_size
+        self.db: Optional[StockDatabase] = None
+        self.universe: List[str] = []
+        self.snapshot: Dict[str, Dict] = {}
+        self.scores: Dict[str, Dict[str, int]] = {}
+        self.scored_price: Dict[str, float] = {}
+        self.status: Dict[str, Any] = {"asof": None, "last_refresh": None, "last_report": None, "refreshes": 0, "rescored": 0}
+        self.report: Optional[Tuple[str, str]] = None  # (파일 경로, 내용)
+        self._lock = threading.RLock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+
+    def bootstrap(self, asof_date: str):
+        """거래일 시작: 유니버스 스크리닝 + 수집·채점 (이미 끝난 단계는 run_ledger에서 이어받음)"""
+        db = StockDatabase(DB_PATH, asof_date=asof_date)
+        universe = db.get_checkpoint("universe")
+        if universe is None:
+            with METRICS.stage("screen"):
+                universe = screen_markets(self.markets)
+            db.checkpoint("universe", universe)
+        with METRICS.stage("pipeline"):
+            run_pipeline(universe, db, self.batch_size)
+        snapshot = db.get_stocks(universe)
+        with self._lock:
+            if self.db: self.db.close()
+            self.db, self.universe, self.snapshot = db, universe, snapshot
+            self.scores = {t: r['scores'] for t, r in snapshot.items() if r['scores']}
+            self.scored_price = {t: r['technical']['price'] for t, r in snapshot.items()}
+            self.status["asof"] = asof_date
+        print(f"[Daemon] {asof_date}: {len(snapshot)}/{len(universe)} collected, {len(self.scores)} scored")
+
+    def refresh(self) -> List[str]:
+        """뉴스와 당일 시세만 다시 받아 메모리 스냅샷 갱신. 반환: 재채점한 종목"""
+        tickers = list(self.snapshot)
+        if not tickers: return []
+        with METRICS.stage("daemon_refresh"):
+            if not (TAPE and TAPE.mode == "replay"):
+                try: get_ohlcv_store().refresh_recent(tickers)
+                except Exception as e: print(f"[Price Error] {e}")
+            try: technical = fetch_technical_panel(tickers)
+            except Exception as e: print(f"[Panel Error] {e}"); technical = {}
+            with ThreadPoolExecutor(max_workers=HOST_LIMITS["m.stock.naver.com"]) as ex:
+                futs = {t: ex.submit(_fetch_news, t.split(".")[0]) for t in tickers}
+            news = {}
+            for t, fut in futs.items():
+                try: news[t] = fut.result()
+                except Exception: METRICS.incr("failures", "m.stock.naver.com")
+            changed = []
+            with self._lock:
+                for t in tickers:
+                    raw = self.snapshot[t]
+                    fresh = dict(raw, technical=technical.get(t) or raw['technical'], news=news.get(t, raw['news']))
+                    moved = abs(fresh['technical']['price'] / (self.scored_price.get(t) or fresh['technical']['price']) - 1)
+                    if fresh['news'] != raw['news'] or moved >= DAEMON_RESCORE_MOVE or t not in self.scores: changed.append(fresh)
+                    self.snapshot[t] = fresh
+            for raw in changed: self.db.update_stock(raw)
+
+        def _on_scored(t, sc):
+            with self._lock:
+                self.scores[t] = sc; self.scored_price[t] = self.snapshot[t]['technical']['price']
+            self.db.save_scores(t, sc, input_fingerprint(self.snapshot[t]))
+        with METRICS.stage("daemon_rescore"):
+            try: score_universe(changed, self.batch_size, on_scored=_on_scored)
+            except Exception as e: print(f"[Analyze Error] {e}")
+        with self._lock:
+            self.status.update(last_refresh=datetime.now().isoformat(timespec="seconds"), refreshes=self.status["refreshes"] + 1,
+                               rescored=self.status["rescored"] + len(changed))
+        print(f"[Daemon] refreshed {len(tickers)} names, rescored {len(changed)}")
+        return [r['ticker'] for r in changed]
+
+    def run_report(self, today_str: str) -> str:
+        """메모리의 스냅샷·점수로 전략 수립 + 선택 + 리포트 (수집 단계 없이)"""
+        with self._lock:
+            snapshot, scored_universe = dict(self.snapshot), _scored_universe(self.snapshot, self.scores, self.universe)
+        if self.db.get_checkpoint("complete") is not None:
+            # 같은 거래일의 이전 리포트 이후: 전략·선택을 새로 수립
+            self.db.reset_run(); self.db.checkpoint("universe", self.universe)
+        strategy, final_stocks, portfolio = run_select(snapshot, scored_universe, today_str, self.db)
+        with METRICS.stage("report"):
+            filename = write_report(today_str, strategy, final_stocks, scored_universe, portfolio)
+        self.db.checkpoint("complete", {"report": filename, "finished_at": datetime.now().isoformat()})
+        METRICS.write("reports", today_str, universe=len(self.universe), collected=len(snapshot), report=filename, **self.status)
+        METRICS.reset()
+        with self._lock:
+            self.report = (filename, open(filename, encoding="utf-8").read())
+            self.status["last_report"] = today_str
+        print(f"[Daemon] Report: {filename}")
+        return filename
+
+    def tick(self):
+        """스케줄러 1회: 거래일이 바뀌었으면 bootstrap, 아니면 증분 갱신. 리포트 시각이 지났으면 하루 한 번 리포트"""
+        asof_date = datetime.strptime(get_latest_trading_day(), "%Y%m%d").strftime("%Y-%m-%d")
+        if asof_date != self.status["asof"]: self.bootstrap(asof_date)
+        else: self.refresh()
+        today_str = datetime.now().strftime('%Y-%m-%d')
+        if datetime.now().strftime("%H:%M") >= self.report_time and self.status["last_report"] != today_str:
+            self.run_report(today_str)
+
+    def loop(self):
+        while not self._stop.is_set():
+            try: self.tick()
+            except Exception as e: print(f"[Daemon Error] {e}")
+            self._wake.wait(self.interval); self._wake.clear()
+
+    def trigger(self):
+        """다음 갱신을 즉시 실행"""
+        self._wake.set()
+
+    def stop(self):
+        self._stop.set(); self._wake.set()
+
+    # --- HTTP ---
+
+    def scores_view(self, ticker: Optional[str] = None) -> List[Dict]:
+        with self._lock:
+            rows = [{"ticker": t, "name": r['name'], "price": r['technical']['price'], "scores": self.scores.get(t),
+                     "total": sum(self.scores[t].values()) if t in self.scores else None}
+                    for t, r in self.snapshot.items() if ticker in (None, t)]
+        return sorted(rows, key=lambda x: x["total"] or 0, reverse=True)
+
+    def handler(self):
+        daemon = self
+        from http.server import BaseHTTPRequestHandler
+
+        class Handler(BaseHTTPRequestHandler):
+            def _send(self, code: int, body: Any, ctype: str = "application/json"):
+                data = (body if isinstance(body, str) else json.dumps(body, ensure_ascii=False, default=str)).encode("utf-8")
+                self.send_response(code)
+                self.send_header("Content-Type", f"{ctype}; charset=utf-8"); self.send_header("Content-Length", str(len(data)))
+                self.end_headers(); self.wfile.write(data)
+
+            def do_GET(self):
+                path, _, query = self.path.partition("?")
+                params = dict(p.partition("=")[::2] for p in query.split("&") if p)
+                if path == "/status":
+                    with daemon._lock: self._send(200, dict(daemon.status, universe=len(daemon.universe), scored=len(daemon.scores)))
+                elif path == "/scores": self._send(200, daemon.scores_view(params.get("ticker")))
+                elif path == "/report":
+                    if daemon.report is None: self._send(404, {"error": "no report yet"})
+                    else: self._send(200, daemon.report[1], "text/markdown")
+                else: self._send(404, {"error": "unknown path", "paths": ["/status", "/scores", "/report", "POST /refresh"]})
+
+            def do_POST(self):
+                if self.path == "/refresh": daemon.trigger(); self._send(202, {"status": "scheduled"})
+                else: self._send(404, {"error": "unknown path"})
+
+            def log_message(self, *args):
+                pass
+        return Handler
+
+def run_daemon(host: str = DAEMON_HOST, port: int = DAEMON_PORT, **kwargs):
+    """스케줄러 스레드 + 로컬 HTTP 엔드포인트 (GET /status, /scores[?ticker=], /report, POST /refresh)"""
+    from http.server import ThreadingHTTPServer
+    daemon = TraderDaemon(**kwargs)
+    server = ThreadingHTTPServer((host, port), daemon.handler())
+    worker = threading.Thread(target=daemon.loop, name="daemon-scheduler", daemon=True)
+    worker.start()
+    print(f"3S-Trader KR daemon: http://{host}:{port} (refresh every {daemon.interval}s, report at {daemon.report_time})")
+    try: server.serve_forever()
+    except KeyboardInterrupt: pass
+    finally:
+        daemon.stop(); server.server_close(); worker.join(timeout=5)
+        if daemon.db: daemon.db.close()
+
+# --- CLI ---
+
+# import 시간 예산 측정 시 실행할 서브커맨드 (이 순서로 같은 임시 상태 디렉터리에서 실행해 앞 단계 결과를 다음 단계가 읽는다)
+BUDGET_ARGS = {
+    "collect": ["collect", "005930.KS"], "analyze": ["analyze"], "select": ["select", "--numeric"], "report": ["report"],
+    "perf": ["perf"], "view": ["view", "005930.KS"], "query": ["query", "1 = 1"], "export": ["export"], "run": ["run"],
+}
+# 서브커맨드 시동(import) 시간 예산 (ms)
+IMPORT_BUDGET_MS = {"collect": 4500, "analyze": 400, "select": 3500, "report": 1000, "perf": 2500, "view": 150, "query": 150, "export": 1000, "run": 4500}
+
+def measure_import_ms(cmd: str, cwd: str, fixtures: str = FIXTURE_DIR, live: bool = False,
+                      timeout: float = 300) -> Tuple[float, List[Tuple[str, float]]]:
+    """새 인터프리터에서 서브커맨드를 실제로 디스패치하고, 그 실행이 불러온 모듈의 import 시간(ms)을 -X importtime으로 합산
+
+    지연 import(_LazyModule)까지 포함된다. 상태는 cwd에 둔다. 기본은 픽스처 재생(TRADER_REPLAY=replay)이라 재생된 외부 호출의
+    본문(yfinance·bs4 등)이 불러오는 모듈은 빠진다. live=True면 실제 외부 호출로 실행해 운영 경로 그대로 측정한다.
+    반환: (합계 ms, import 시간이 큰 최상위 모듈 상위 3개). 서브커맨드가 0이 아닌 코드로 끝나면 RuntimeError
+    """
+    here = os.path.dirname(os.path.abspath(__file__))
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [here, os.environ.get("PYTHONPATH")])),
+               TRADER_REPLAY="" if live else "replay", TRADER_FIXTURE_DIR=os.path.abspath(fixtures), LLM_DISABLED="1", LLM_CACHE="0")
+    # 인터프리터 시동 import는 표식 이후만 세어 제외
+    code = f"import sys; sys.stderr.write('--budget--\\n'); sys.stderr.flush(); import trader; trader.cli({BUDGET_ARGS[cmd]!r})"
+    out = subprocess.run([sys.executable, "-X", "importtime", "-c", code], capture_output=True, text=True, cwd=cwd, env=env, timeout=timeout)
+    if out.returncode != 0:
+        errors = [l for l in out.stderr.splitlines() if not l.startswith("import time:")]
+        raise RuntimeError(f"exit {out.returncode}: {errors[-1] if errors else ''}")
+    # "import time: self [us] | cumulative | imported package". 들여쓰기 없는 줄이 최상위 import
+    top = {}
+    for line in out.stderr.partition("--budget--\n")[2].splitlines():
+        m = re.match(r"import time:\s+\d+ \|\s+(\d+) \| (\S.*)$", line)
+        if m: top[m.group(2)] = top.get(m.group(2), 0) + int(m.group(1)) / 1000
+    return sum(top.values()), sorted(top.items(), key=lambda x: -x[1])[:3]
+
+def _open_db(args, trading_day: bool = False) -> StockDatabase:
+    """--date > (collect면 최근 거래일 | 그 외에는 DB에 저장된 최신 일자)"""
+    db = StockDatabase(DB_PATH, asof_date=args.date)
+    if not args.date:
+        db.asof_date = (datetime.strptime(get_latest_trading_day(), "%Y%m%d").strftime("%Y-%m-%d") if trading_day
+                        else db.latest_asof() or db.asof_date)
+    return db
+
+def cmd_collect(args):
+    db = _open_db(args, trading_day=True)
+    universe = args.tickers or screen_markets()
+    def _save(raw):
+        db.update_stock(raw); print(f" Saved DB: {raw['ticker']}")
+    with METRICS.stage("collect"):
+        collect_universe(universe, on_result=_save)
+    db.close()
+
+def cmd_analyze(args):
+    db = _open_db(args)
+    with METRICS.stage("analyze"):
+        snapshot, scores, reused = run_analyze(db, args.tickers or None, args.batch_size)
+    print(f" Reused scores: {reused}/{len(snapshot)} ({db.asof_date})")
+    db.close()
+
+def _scored_from_db(db: StockDatabase) -> Tuple[Dict[str, Dict], List[Dict]]:
+    snapshot = db.get_stocks()
+    return snapshot, _scored_universe(snapshot, {t: r['scores'] for t, r in snapshot.items() if r['scores']})
+
+def cmd_select(args):
+    db = _open_db(args)
+    snapshot, scored_universe = _scored_from_db(db)
+    strategy, final_stocks, _ = run_select(snapshot, scored_universe, datetime.now().strftime('%Y-%m-%d'),
+                                           mode="numeric" if args.numeric else SELECTION_MODE)
+    print(f" Selected: {[s.get('stock_code') for s in final_stocks]}")
+    db.close()
+
+def cmd_report(args):
+    db = _open_db(args)
+    _, scored_universe = _scored_from_db(db)
+    db.close()
+    trajectory = load_trajectory()
+    if not trajectory: print("No selection found. Run 'select' first."); return
+    entry = trajectory[-1]
+    print(f"Report: {write_report(entry['date'], entry['strategy'], entry['selected'], scored_universe, PortfolioAnalytics().metrics())}")
+
+def cmd_perf(args):
+    trajectory, _, portfolio = run_perf(load_trajectory())
+    save_trajectory(trajectory)
+    print(json.dumps(portfolio, ensure_ascii=False, indent=2))
+
+def cmd_view(args):
+    db = StockDatabase(DB_PATH)
+    row = db.get_stock(args.ticker)
+    db.close()
+    if not row: print(f"Ticker {args.ticker} not found."); return
+    print(f"\n=== [RDB Raw Data Monitor: {row['name']} ({args.ticker})] ===\nLast Update: {row['timestamp']}")
+    for key in RAW_KEYS + ['scores']:
+        print(f"\n[{key.upper()}]\n{json.dumps(row[key], indent=2, ensure_ascii=False)}")
+
+def cmd_query(args):
+    db = _open_db(args)
+    rows = db.screen(args.where)
+    db.close()
+    cols = ["ticker", "name"] + [f for _, f, _ in SNAPSHOT_FIELDS if any(r[f] is not None for r in rows)]
+    print("\t".join(cols))
+    for r in rows: print("\t".join("" if r[c] is None else str(r[c]) for c in cols))
+    print(f"({len(rows)} rows, {db.asof_date})")
+
+def cmd_export(args):
+    db = _open_db(args)
+    print(f"Parquet snapshot: {db.export_parquet()}")
+    db.close()
+
+def cmd_budget(args):
+    # 픽스처가 없으면 재생 실행이 수집 초기에 끝나 실제보다 훨씬 적게 측정되므로 측정하지 않는다
+    if not args.live and not any(files for _, _, files in os.walk(args.fixtures)):
+        print(f"No fixtures in {args.fixtures}. Record them (TRADER_REPLAY=record python trader.py) or use --live."); sys.exit(1)
+    over = False
+    import tempfile
+    with tempfile.TemporaryDirectory() as tmp:
+        for cmd, budget in IMPORT_BUDGET_MS.items():
+            try: ms, heavy = measure_import_ms(cmd, tmp, args.fixtures, args.live)
+            except Exception as e:
+                over = True; print(f" {cmd:<8}   FAILED  ({e})"); continue
+            over |= ms > budget
+            print(f" {cmd:<8} {ms:8.1f} ms  (budget {budget} ms){'  OVER' if ms > budget else ''}  "
+                  + ", ".join(f"{m} {t:.0f}" for m, t in heavy))
+    if over: sys.exit(1)
+
+def cmd_daemon(args):
+    run_daemon(args.host, args.port, markets=[m.upper() for m in args.markets] if args.markets else None,
+               interval=args.interval, report_time=args.report_time)
 
-    print(f"Report: {filename}")
+def cli(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(prog="trader.py", description="3S-Trader KR")
+    sub = parser.add_subparsers(dest="command")
+    p = sub.add_parser("run", help="전체 파이프라인 (기본값)")
+    p.add_argument("--fresh", action="store_true", help="진행 기록을 무시하고 처음부터 실행")
+    p.add_argument("--shards", type=int, default=int(os.getenv("TRADER_SHARDS", 0)), help="수집·채점 워커 프로세스 수")
+    p.add_argument("--markets", nargs="+", help="예: KOSPI KOSDAQ (기본: UNIVERSE_MARKETS)")
+    p = sub.add_parser("collect", help="스크리닝 + 원천 데이터 수집"); p.add_argument("tickers", nargs="*"); p.add_argument("--date")
+    p = sub.add_parser("analyze", help="저장된 스냅샷 채점"); p.add_argument("tickers", nargs="*"); p.add_argument("--date")
+    p.add_argument("--batch-size", type=int, default=SCORE_BATCH_SIZE)
+    p = sub.add_parser("select", help="전략 수립 + 종목 선택"); p.add_argument("--date")
+    p.add_argument("--numeric", action="store_true", help="LLM 대신 numeric_selection으로 선택")
+    p = sub.add_parser("report", help="저장된 결과로 리포트 작성"); p.add_argument("--date")
+    sub.add_parser("perf", help="포트폴리오 성과 갱신")
+    p = sub.add_parser("view", help="원천 데이터 조회 (sqlite만 사용)"); p.add_argument("ticker")
+    p = sub.add_parser("query", help="정형 컬럼 SQL 조건으로 스크리닝 (예: \"vol_spike > 2 and pbr < 1\")"); p.add_argument("where"); p.add_argument("--date")
+    p = sub.add_parser("export", help="일자별 스냅샷을 Parquet로 내보내기"); p.add_argument("--date")
+    p = sub.add_parser("budget", help="서브커맨드를 실제로 실행해 import 시간 측정")
+    p.add_argument("--fixtures", default=FIXTURE_DIR, help="재생할 픽스처 디렉터리")
+    p.add_argument("--live", action="store_true", help="재생 대신 실제 외부 호출로 실행 (수집 경로의 import까지 측정)")
+    p = sub.add_parser("daemon", help="상주 모드: 주기적 증분 갱신 + 로컬 HTTP 엔드포인트")
+    p.add_argument("--host", default=DAEMON_HOST); p.add_argument("--port", type=int, default=DAEMON_PORT)
+    p.add_argument("--interval", type=int, default=DAEMON_REFRESH_SECONDS, help="갱신 주기(초)")
+    p.add_argument("--report-time", default=DAEMON_REPORT_TIME, help="일일 리포트 시각 HH:MM")
+    p.add_argument("--markets", nargs="+", help="예: KOSPI KOSDAQ (기본: UNIVERSE_MARKETS)")
+    args = parser.parse_args(argv)
+    handlers = {"collect": cmd_collect, "analyze": cmd_analyze, "select": cmd_select, "report": cmd_report,
+                "perf": cmd_perf, "view": cmd_view, "query": cmd_query, "export": cmd_export, "budget": cmd_budget, "daemon": cmd_daemon}
+    run = lambda a: main(resume=not getattr(a, "fresh", False), shards=getattr(a, "shards", int(os.getenv("TRADER_SHARDS", 0))),
+                         markets=[m.upper() for m in a.markets] if getattr(a, "markets", None) else None)
+    handlers.get(args.command, run)(args)
 
-if __name__ == "__main__": main()
+if __name__ == "__main__": cli()
@@ -1,30 +1,14 @@
-import sqlite3
-import json
 import sys
 import os
 
-def view_db(ticker):
-    db_path = "state/trader_database.db"
-    if not os.path.exists(db_path):
-        print("Database not found.")
-        return
+# Add current directory to path so we can import trader
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
-    with sqlite3.connect(db_path) as conn:
-        conn.row_factory = sqlite3.Row
-        cur = conn.execute("SELECT * FROM raw_data WHERE ticker = ?", (ticker,))
-        row = cur.fetchone()
-        
-        if not row:
-            print(f"Ticker {ticker} not found.")
-            return
+import trader
 
-        print(f"\n=== [RDB Raw Data Monitor: {row['name']} ({ticker})] ===")
-        print(f"Last Update: {row['timestamp']}")
-        
-        for key in ['technical', 'fundamental', 'dart', 'investor', 'news']:
-            print(f"\n[{key.upper()}]")
-            data = json.loads(row[key])
-            print(json.dumps(data, indent=2, ensure_ascii=False))
+def view_db(ticker):
+    # stock_snapshot(최신 거래일)에서 조회. `python trader.py view <ticker>`와 같다
+    trader.cli(["view", ticker])
 
 if __name__ == "__main__":
     if len(sys.argv) > 1: